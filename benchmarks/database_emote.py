@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# Emote Collector collects emotes from other servers for use by people without Nitro
+# Copyright © 2018–2019 lambda#0987
+#
+# Emote Collector is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Emote Collector is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Emote Collector. If not, see <https://www.gnu.org/licenses/>.
+
+"""measure the per row cost of building a DatabaseEmote and formatting it for ec/list,
+compared to the implementation that set each column in a loop.
+
+usage: python3 benchmarks/database_emote.py [rows]
+"""
+
+import builtins
+import contextlib
+import datetime
+import sys
+import timeit
+
+builtins._ = lambda s: s
+
+from emote_collector import utils
+from emote_collector.extensions.db import DatabaseEmote
+
+class OldDatabaseEmote:
+	"""DatabaseEmote as it was before it was optimized, for comparison"""
+
+	__slots__ = frozenset((
+		'name',
+		'id',
+		'author',
+		'animated',
+		'description',
+		'created',
+		'modified',
+		'preserve',
+		'guild',
+		'nsfw',
+		'usage'))
+
+	def __init__(self, record):
+		for column in self.__slots__:
+			with contextlib.suppress(KeyError):
+				setattr(self, column, record[column])
+
+	def __str__(self):
+		animated = 'a' if self.animated else ''
+		return '<{0}:{1.name}:{1.id}>'.format(animated, self)
+
+	def escaped_name(self):
+		return fr'\:{self.name}:'
+
+	def linked_name(self):
+		return f'[{self.escaped_name()}]({self.url})'
+
+	def with_linked_name(self, *, separator='|'):
+		return f'{self} {separator} {self.linked_name()}'
+
+	def status(self):
+		if self.preserve and self.is_nsfw:
+			return _('(Preserved, NSFW)')
+		if self.preserve and not self.is_nsfw:
+			return _('(Preserved)')
+		if not self.preserve and self.is_nsfw:
+			return _('(NSFW)')
+		return ''
+
+	def with_status(self, *, linked=False):
+		formatted = self.with_linked_name() if linked else self.with_name()
+		return f'{formatted} {self.status()}'
+
+	@property
+	def url(self):
+		return utils.emote.url(self.id, animated=self.animated)
+
+	@property
+	def is_nsfw(self):
+		return self.nsfw.endswith('NSFW')
+
+def rows(n):
+	created = datetime.datetime.now(datetime.timezone.utc)
+	# every column of the emotes table. asyncpg.Record supports the same lookups as dict.
+	return [
+		dict(
+			name=f'emote{i}', id=500000000000000000 + i, author=140516693242937345, animated=i % 3 == 0,
+			description=None, created=created, modified=None, preserve=i % 7 == 0, guild=500000000000000000,
+			nsfw='SELF_NSFW' if i % 5 == 0 else 'SFW')
+		for i in range(n)]
+
+def bench(name, cls, records):
+	number = 10
+
+	construct = min(timeit.repeat(lambda: list(map(cls, records)), number=number, repeat=5))
+	emotes = list(map(cls, records))
+	format = min(timeit.repeat(lambda: [emote.with_status(linked=True) for emote in emotes], number=number, repeat=5))
+
+	per_row = lambda total: total / number / len(records) * 1e9
+	print(f'{name:>4}: construct {per_row(construct):7.0f} ns/row, format {per_row(format):7.0f} ns/row')
+
+def main():
+	n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+	records = rows(n)
+	bench('old', OldDatabaseEmote, records)
+	bench('new', DatabaseEmote, records)
+
+if __name__ == '__main__':
+	main()
@@ -51,6 +51,9 @@ class EmoteCollector(Bot):
 		self.jinja_env = jinja2.Environment(
 			loader=jinja2.FileSystemLoader(str(BASE_DIR / 'sql')),
 			line_statement_prefix='-- :')
+		# (message ID, edited_at) → MessagePipeline
+		self._pipelines = utils.cache.LRUCache(1_000, ttl=60)
+		self.invalidation_bus = utils.invalidation.InvalidationBus(self)
 
 	def process_config(self):
 		super().process_config()
@@ -62,13 +65,15 @@ class EmoteCollector(Bot):
 	### Events
 
 	async def on_message(self, message):
-		if self.should_reply(message):
-			await self.set_locale(message)
-			await self.process_commands(message)
+		if not self.should_reply(message):
+			return
+
+		pipeline = self.pipeline(message)
+		await pipeline.set_locale()
+		await self.invoke(await pipeline.context())
 
 	async def set_locale(self, message):
-		locale = await self.cogs['Locales'].locale(message)
-		utils.i18n.current_locale.set(locale)
+		await self.pipeline(message).set_locale()
 
 	# https://github.com/Rapptz/RoboDanny/blob/ca75fae7de132e55270e53d89bc19dd2958c2ae0/bot.py#L77-L85
 	async def on_command_error(self, context, error):
@@ -105,6 +110,15 @@ class EmoteCollector(Bot):
 
 	### Utility functions
 
+	def pipeline(self, message) -> utils.pipeline.MessagePipeline:
+		"""return the MessagePipeline for message, which is shared by every listener for that message"""
+		key = message.id, message.edited_at
+		try:
+			return self._pipelines[key]
+		except KeyError:
+			pipeline = self._pipelines[key] = utils.pipeline.MessagePipeline(self, message)
+			return pipeline
+
 	async def get_context(self, message, cls=None):
 		return await super().get_context(message, cls=cls or utils.context.CustomContext)
 
@@ -120,8 +134,8 @@ class EmoteCollector(Bot):
 
 		return True
 
-	def queries(self, template_name):
-		return self.jinja_env.get_template(str(template_name)).module
+	def queries(self, template_name) -> utils.queries.QueryRegistry:
+		return utils.queries.QueryRegistry(self.jinja_env.get_template(str(template_name)).module)
 
 	### Init / Shutdown
 
@@ -147,6 +161,19 @@ class EmoteCollector(Bot):
 			sql}}
 	""".replace('\t', '').replace('\n', '')))
 
+	async def init_db(self):
+		# the same as Bot.init_db, except that the invalidation bus needs to know which connections are ours
+		self.pool = await asyncpg.create_pool(**self.config['database'], init=self.invalidation_bus.init_connection)
+
 	def load_extensions(self):
 		utils.i18n.set_default_locale()
 		super().load_extensions()
+		# the cogs have registered their handlers by now
+		self.invalidation_bus.start()
+
+	async def close(self):
+		# this has to happen before the pool is closed
+		with contextlib.suppress(KeyError):
+			await self.cogs['Database'].flush_emote_usage()
+		self.invalidation_bus.close()
+		await super().close()
@@ -8,6 +8,37 @@
 			'usage': 2,
 			'time': datetime.timedelta(weeks=4),
 		},
+		'batch_size': 100,  # how many decayed emotes to delete from the database and log at once
+	},
+
+	# emote uses are buffered in memory and written to the database in batches
+	'usage_logging': {
+		'flush_interval': 10.0,  # seconds between writes
+		'flush_threshold': 500,  # write early once this many uses are buffered
+		# if the database is unreachable, keep at most this many uses and drop the oldest ones
+		'max_buffered': 50_000,
+		# individual uses older than this are deleted; daily totals are kept forever
+		'raw_retention': datetime.timedelta(weeks=4),
+	},
+
+	# how many emotes may be uploaded to the backend guilds at once
+	'max_concurrent_emote_creations': 5,
+	# how many backend guilds emotes may be deleted from at once. deletions within one guild are sequential.
+	'max_concurrent_emote_deletions': 5,
+
+	# user and guild opt in / blacklist state is cached to avoid a query on every message
+	'opt_cache': {
+		'size': 10_000,  # entries per table
+		'ttl': 600,  # seconds
+	},
+
+	# the bot remembers which messages it replied to, so that it can edit or delete its replies
+	'replies': {
+		'recent_window': datetime.timedelta(hours=1),  # how long to keep replies in memory as well
+		'max_age': datetime.timedelta(weeks=2),  # edits to and deletions of older messages are ignored
+		# roughly how many message IDs to expect in the database. each reply stores two.
+		# if there are more, the bot will use more memory to keep track of them.
+		'filter_capacity': 1_000_000,
 	},
 
 	# your instance of the website code located at https://github.com/EmoteCollector/website
@@ -19,6 +19,7 @@ import contextlib
 import secrets
 
 import discord
+from bot_bin.sql import connection, optional_connection
 from discord.ext import commands
 
 from .. import utils
@@ -94,8 +95,9 @@ class API(commands.Cog):
 		"""get the user's API token. If they don't already have a token, make a new one"""
 		return await self.existing_token(user_id) or await self.new_token(user_id)
 
+	@optional_connection
 	async def delete_user_account(self, user_id):
-		await self.bot.pool.execute(self.queries.delete_token(), user_id)
+		await connection().execute(self.queries.delete_token(), user_id)
 
 	async def existing_token(self, user_id):
 		secret = await self.bot.pool.fetchval(self.queries.existing_token(), user_id)
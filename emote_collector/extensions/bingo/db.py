@@ -65,7 +65,7 @@ class BingoDatabase(commands.Cog):
 		async with connection().transaction(isolation='repeatable_read'):
 			marks = list(marks)
 			params = (
-				(user_id, bingo.index(point), emote.nsfw, emote.name, emote.id, emote.animated)
+				(user_id, bingo.index(point), emote.nsfw.value, emote.name, emote.id, emote.animated)
 				for point, emote
 				in marks)
 			await connection().executemany(self.queries.set_board_mark(), params)
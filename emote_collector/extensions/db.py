@@ -15,11 +15,14 @@
 # along with Emote Collector. If not, see <https://www.gnu.org/licenses/>.
 
 import asyncio
+import collections
 import contextlib
 import datetime
 import enum
+import functools
+import hashlib
+import heapq
 import logging
-import operator
 import random
 import re
 import time
@@ -27,6 +30,7 @@ import typing
 
 import asyncpg
 import discord
+from bot_bin.sql import connection, optional_connection
 from discord.ext import tasks, commands
 
 from .. import utils
@@ -77,8 +81,18 @@ class MessageReplyType(enum.Enum):
 	auto = 'AUTO'
 	quote = 'QUOTE'
 
+class NsfwStatus(enum.Enum):
+	sfw = 'SFW'
+	self_nsfw = 'SELF_NSFW'
+	mod_nsfw = 'MOD_NSFW'
+
+# faster than calling NsfwStatus, which matters since every emote row gets converted
+_NSFW_STATUSES = {status.value: status for status in NsfwStatus}
+
 class DatabaseEmote:
-	__slots__ = frozenset((
+	"""An emote row. Columns missing from the row (e.g. usage, unless it was queried) are None."""
+
+	__slots__ = (
 		'name',
 		'id',
 		'author',
@@ -89,12 +103,25 @@ class DatabaseEmote:
 		'preserve',
 		'guild',
 		'nsfw',
-		'usage'))
+		'usage',
+		'_str',
+		'_url')
 
 	def __init__(self, record):
-		for column in self.__slots__:
-			with contextlib.suppress(KeyError):
-				setattr(self, column, record[column])
+		# this runs for every emote row, so it avoids per column loops and exception handling
+		get = record.get
+		self.name = get('name')
+		self.id = get('id')
+		self.author = get('author')
+		self.animated = get('animated')
+		self.description = get('description')
+		self.created = get('created')
+		self.modified = get('modified')
+		self.preserve = get('preserve')
+		self.guild = get('guild')
+		self.nsfw = _NSFW_STATUSES.get(get('nsfw'))
+		self.usage = get('usage')
+		self._str = self._url = None
 
 	def __hash__(self):
 		return self.id >> 22
@@ -103,8 +130,9 @@ class DatabaseEmote:
 		return self.id == other.id and isinstance(other, (type(self), discord.PartialEmoji, discord.Emoji))
 
 	def __str__(self):
-		animated = 'a' if self.animated else ''
-		return '<{0}:{1.name}:{1.id}>'.format(animated, self)
+		if self._str is None:
+			self._str = f'<{"a" if self.animated else ""}:{self.name}:{self.id}>'
+		return self._str
 
 	def as_reaction(self):
 		"""return this emote as a string suitable for passing to Message.add_reaction"""
@@ -144,28 +172,434 @@ class DatabaseEmote:
 
 	@property
 	def url(self):
-		return utils.emote.url(self.id, animated=self.animated)
+		if self._url is None:
+			self._url = utils.emote.url(self.id, animated=self.animated)
+		return self._url
 
 	@property
 	def is_nsfw(self):
-		return self.nsfw.endswith('NSFW')
+		return self.nsfw is not NsfwStatus.sfw
+
+OptState = collections.namedtuple('OptState', 'state blacklist_reason')
+# the state of a user or guild which has no row in the opt table
+NO_OPT_STATE = OptState(state=None, blacklist_reason=None)
+
+EmoteCounts = collections.namedtuple('EmoteCounts', 'static animated nsfw total')
+
+class EmoteCache:
+	"""A case insensitive mapping of emote names to DatabaseEmotes, kept in sync with the emotes table.
+
+	Once the cache has been warmed (ready is set), it holds every emote,
+	so a name that isn't in it does not exist in the database either, and counts() matches the table.
+	"""
+
+	def __init__(self):
+		self._emotes = {}
+		# id → lowercased name, so that renames can find the old entry
+		self._names = {}
+		self._counts = collections.Counter()
+		self._name_index = utils.trigram.TrigramIndex()
+		# lowercased query → emotes, ranked
+		self._search_results = utils.cache.LRUCache(256)
+		# one list per load in progress, of the changes made since it started, as (method, argument)
+		self._journals = []
+		self.ready = asyncio.Event()
+		self.hits = self.misses = 0
+
+	def __len__(self):
+		return len(self._emotes)
+
+	def __contains__(self, name):
+		return name.lower() in self._emotes
+
+	def get(self, name):
+		"""return the emote called name, or None if it is not cached"""
+		try:
+			emote = self._emotes[name.lower()]
+		except KeyError:
+			self.misses += 1
+			return None
+		else:
+			self.hits += 1
+			return emote
+
+	def _record(self, method, argument):
+		for journal in self._journals:
+			journal.append((method, argument))
+
+	def update(self, emote):
+		"""add or replace an emote, removing its old name if it was renamed"""
+		self._record(self._update, emote)
+		self._update(emote)
+
+	def _update(self, emote):
+		self._discard(emote.id)
+		self._emotes[emote.name.lower()] = emote
+		self._names[emote.id] = emote.name.lower()
+		self._count(emote, 1)
+		self._name_index.add(emote.id, emote.name)
+		self._search_results.clear()
+
+	def get_by_id(self, emote_id):
+		"""return the emote with the given ID, or None if it is not cached"""
+		try:
+			return self._emotes[self._names[emote_id]]
+		except KeyError:
+			return None
+
+	def discard(self, emote_id):
+		self._record(self._discard, emote_id)
+		self._discard(emote_id)
+
+	def _discard(self, emote_id):
+		try:
+			emote = self._emotes.pop(self._names.pop(emote_id))
+		except KeyError:
+			return
+		self._count(emote, -1)
+		self._name_index.discard(emote_id)
+		self._search_results.clear()
+
+	def _count(self, emote, n):
+		self._counts['animated' if emote.animated else 'static'] += n
+		self._counts['nsfw'] += n * emote.is_nsfw
+		self._counts['total'] += n
+
+	def search(self, query):
+		"""return every emote whose name is similar to query, ranked the same way as the search query"""
+		key = query.lower()
+		try:
+			return self._search_results[key]
+		except KeyError:
+			pass
+
+		results = self._search_results[key] = [
+			self._emotes[self._names[id]] for id in self._name_index.search(query)]
+		return results
+
+	def counts(self) -> EmoteCounts:
+		return EmoteCounts(*map(self._counts.__getitem__, EmoteCounts._fields))
+
+	def discard_guild(self, guild_id):
+		"""remove all emotes stored in the given backend guild"""
+		self._record(self._discard_guild, guild_id)
+		self._discard_guild(guild_id)
+
+	def _discard_guild(self, guild_id):
+		for emote in [emote for emote in self._emotes.values() if emote.guild == guild_id]:
+			self._discard(emote.id)
+
+	async def load(self, emotes):
+		"""replace the contents of the cache with the emotes returned by the awaitable emotes, and mark it as ready.
+		Changes made to the cache while awaiting them are applied again afterwards, since the emotes may predate them.
+		"""
+		journal = []
+		self._journals.append(journal)
+		try:
+			emotes = await emotes
+		finally:
+			self._journals.remove(journal)
+
+		self._emotes.clear()
+		self._names.clear()
+		self._counts.clear()
+		self._name_index.clear()
+		self._search_results.clear()
+		for emote in emotes:
+			self._update(emote)
+		for method, argument in journal:
+			method(argument)
+		self.ready.set()
+
+	def info(self):
+		return utils.cache.CacheInfo(self.hits, self.misses, len(self))
+
+class RecentReplies:
+	"""The replies sent since this was created and during the last `window`, indexed by invoking and reply message ID.
+
+	Replies are always sent after the messages that invoked them, so this holds every reply
+	whose invoking or reply message ID is covered, and a miss for such an ID means that the replies table
+	has no matching row either.
+	"""
+
+	def __init__(self, window: datetime.timedelta):
+		self.window = window
+		self._since = discord.utils.time_snowflake(datetime.datetime.utcnow())
+		# invoking message ID → (MessageReplyType, reply message ID), in the order the replies were sent
+		self._by_invoking = collections.OrderedDict()
+		# reply message ID → invoking message ID
+		self._by_reply = {}
+
+	def __len__(self):
+		return len(self._by_invoking)
+
+	def __contains__(self, message_id):
+		"""return whether message_id is the invoking or reply message ID of a known reply"""
+		return message_id in self._by_invoking or message_id in self._by_reply
+
+	def _cutoff(self):
+		return max(self._since, discord.utils.time_snowflake(datetime.datetime.utcnow() - self.window))
+
+	def covers(self, message_id):
+		"""return whether every reply involving message_id is known to this tracker"""
+		return message_id >= self._cutoff()
+
+	def add(self, invoking_message, reply_type, reply_message):
+		self._by_invoking[invoking_message] = reply_type, reply_message
+		self._by_reply[reply_message] = invoking_message
+
+	def get(self, invoking_message):
+		"""return (reply_type, reply_message) for invoking_message, or None if there's no such reply"""
+		return self._by_invoking.get(invoking_message)
+
+	def pop_by_invoking(self, invoking_message):
+		"""forget and return the reply message ID for invoking_message, or None if there's no such reply"""
+		try:
+			reply_type, reply_message = self._by_invoking.pop(invoking_message)
+		except KeyError:
+			return None
+		del self._by_reply[reply_message]
+		return reply_message
+
+	def pop_by_reply(self, reply_message):
+		"""forget the reply with message ID reply_message. Return whether it was known."""
+		try:
+			invoking_message = self._by_reply.pop(reply_message)
+		except KeyError:
+			return False
+		del self._by_invoking[invoking_message]
+		return True
+
+	def prune(self):
+		"""forget all replies that were sent before the start of the window"""
+		cutoff = self._cutoff()
+		while self._by_invoking:
+			invoking_message, (reply_type, reply_message) = next(iter(self._by_invoking.items()))
+			if reply_message >= cutoff:
+				break
+			self.pop_by_invoking(invoking_message)
+
+class SlotAllocator:
+	"""Keeps track of how many static and animated emote slots are used in each backend guild,
+	and hands out free slots, preferring the guild that least recently had a slot handed out.
+	Spreading creations out like that keeps us clear of the per guild emote creation rate limit.
+	A guild that is rate limited anyway is deferred until its limit expires.
+
+	Each guild has one heap entry per emote type while it has a free slot of that type.
+	Entries are invalidated lazily: one is stale if its guild has since been used, removed, or filled up.
+	"""
+
+	def __init__(self):
+		# guild ID → emote limit, which applies to static and animated emotes separately
+		self._limits = {}
+		# guild ID → [static usage, animated usage]
+		self._usage = {}
+		# guild ID → time.time() of the last slot handed out, or of the last emote creation,
+		# or of when its rate limit expires if that's later
+		self._ready_at = {}
+		# static, animated: heaps of (ready at, guild ID) of guilds with free slots
+		self._heaps = [], []
+		# static, animated: IDs of guilds with a valid heap entry
+		self._queued = set(), set()
+
+	def __len__(self):
+		return len(self._limits)
+
+	def add_guild(self, guild_id, limit, static_usage=0, animated_usage=0, ready_at=0.0):
+		self._limits[guild_id] = limit
+		self._usage[guild_id] = [static_usage, animated_usage]
+		self._ready_at[guild_id] = ready_at
+		self._requeue(guild_id)
+
+	def remove_guild(self, guild_id):
+		for mapping in self._limits, self._usage, self._ready_at:
+			mapping.pop(guild_id, None)
+		for queued in self._queued:
+			queued.discard(guild_id)
+
+	def set_limit(self, guild_id, limit):
+		"""update the emote limit of a guild, e.g. after its premium tier changed"""
+		if guild_id in self._limits:
+			self._limits[guild_id] = limit
+			self._requeue(guild_id)
+
+	def free_slots(self, guild_id, animated):
+		return self._limits[guild_id] - self._usage[guild_id][animated]
+
+	def _queue(self, guild_id, animated):
+		queued = self._queued[animated]
+		if guild_id not in queued and self.free_slots(guild_id, animated) > 0:
+			heapq.heappush(self._heaps[animated], (self._ready_at[guild_id], guild_id))
+			queued.add(guild_id)
+
+	def _requeue(self, guild_id):
+		for animated in False, True:
+			# any existing entry is now stale, if ready_at changed
+			self._queued[animated].discard(guild_id)
+			self._queue(guild_id, animated)
+
+	def allocate(self, animated) -> int:
+		"""reserve a slot and return the ID of the guild it's in. Call release() if it ends up unused.
+		Raise NoMoreSlotsError if every guild is full.
+		"""
+		heap, queued = self._heaps[animated], self._queued[animated]
+		while heap:
+			ready_at, guild_id = heapq.heappop(heap)
+			if guild_id not in queued or self._ready_at[guild_id] != ready_at:
+				continue
+			queued.discard(guild_id)
+
+			self._usage[guild_id][animated] += 1
+			self._ready_at[guild_id] = max(time.time(), ready_at)
+			self._requeue(guild_id)
+			return guild_id
+
+		raise errors.NoMoreSlotsError
+
+	def ready_at(self, guild_id):
+		"""return the time.time() at which guild_id may next be used"""
+		return self._ready_at[guild_id]
+
+	def defer(self, guild_id, until):
+		"""don't hand out slots in guild_id until the time.time() until, unless every other guild is deferred too"""
+		if guild_id in self._ready_at and until > self._ready_at[guild_id]:
+			self._ready_at[guild_id] = until
+			self._requeue(guild_id)
+
+	def use(self, guild_id, animated):
+		"""mark a slot as used by an emote that was not allocated here, e.g. one created by another process"""
+		try:
+			usage = self._usage[guild_id]
+		except KeyError:
+			return
+		usage[animated] += 1
+		if self.free_slots(guild_id, animated) <= 0:
+			# its heap entry, if any, is now stale
+			self._queued[animated].discard(guild_id)
+
+	def release(self, guild_id, animated):
+		"""mark a slot as free, because its emote was removed or its reservation went unused"""
+		try:
+			usage = self._usage[guild_id]
+		except KeyError:
+			return
+		usage[animated] = max(0, usage[animated] - 1)
+		self._queue(guild_id, animated)
+
+	def capacity(self):
+		"""return a three-tuple of static capacity, animated, total"""
+		capacity = sum(self._limits.values())
+		return capacity, capacity, capacity * 2
+
+class EmojiRateLimitHandler(logging.Handler):
+	"""Passes the guild ID and retry delay of every emoji rate limit that discord.py reports
+	to on_create for emoji creations, or to on_delete for emoji deletions (and edits, which share their bucket).
+
+	discord.py handles 429 responses itself by sleeping and retrying while it holds the bucket's lock,
+	so the only place the rate limit state surfaces is its log. That means this only works as long as
+	the discord.http logger lets warnings through, and discord.py keeps the wording of the message.
+	"""
+
+	# the bucket of a route is "channel_id:guild_id:path", where path still has its placeholders
+	EMOJI_BUCKET_RE = re.compile(r'[^:]*:(?P<guild_id>\d+):/guilds/\{guild_id\}/emojis(?P<emoji>/\{emoji_id\})?')
+
+	def __init__(self, on_create, on_delete):
+		super().__init__(logging.WARNING)
+		self.on_create = on_create
+		self.on_delete = on_delete
+
+	def emit(self, record):
+		# 'We are being rate limited. Retrying in %.2f seconds. Handled under the bucket "%s"'
+		if not str(record.msg).startswith('We are being rate limited.') or len(record.args) != 2:
+			return
+
+		retry_after, bucket = record.args
+		match = self.EMOJI_BUCKET_RE.fullmatch(str(bucket))
+		if match is None:
+			return
+
+		callback = self.on_create if match['emoji'] is None else self.on_delete
+		callback(int(match['guild_id']), retry_after)
 
 class Database(commands.Cog):
 	def __init__(self, bot):
 		self.bot = bot
 		self._process_decay_config()
+		self._process_usage_logging_config()
+		self._process_opt_cache_config()
+		self._process_emote_creation_config()
+		self._process_replies_config()
 		self.queries = self.bot.queries('emotes.sql')
 
+		self.emote_cache = EmoteCache()
+		self.slots = SlotAllocator()
+		# guild ID → time.time() at which its emoji deletion rate limit expires
+		self._deletion_ready_at = {}
+		self._rate_limit_handler = EmojiRateLimitHandler(
+			self._on_emoji_creation_rate_limit, self._on_emoji_deletion_rate_limit)
+		http_logger = logging.getLogger('discord.http')
+		http_logger.addHandler(self._rate_limit_handler)
+		if not http_logger.isEnabledFor(logging.WARNING):
+			logger.warning(
+				'the discord.http logger ignores warnings, '
+				'so emote creations and deletions will not avoid rate limited backend guilds')
+		# limits how many emotes are being created at once, across all guilds, to stay clear of the global rate limit
+		self._emote_creation_semaphore = asyncio.Semaphore(self.bot.config['max_concurrent_emote_creations'])
+		# (emote_id, time) pairs that have yet to be written to emote_usage_history
+		self.usage_buffer = []
+		self._usage_flush_task = None
+		# whether emote_usage_rollup is known to hold every use, which decay relies on
+		self._have_emote_usage_rollup = False
+		opt_cache_settings = self.bot.config['opt_cache']
+		# table name → LRUCache of id → OptState
+		self.opt_caches = {
+			table_name: utils.cache.LRUCache(opt_cache_settings['size'], ttl=opt_cache_settings['ttl'])
+			for table_name in ('user_opt', 'guild_opt')}
+		# table name → how many times any of its rows has been written to or invalidated in its cache,
+		# so that a read can tell whether the row it fetched may have been superseded in the meantime
+		self._opt_generations = dict.fromkeys(self.opt_caches, 0)
+		self.recent_replies = RecentReplies(self.bot.config['replies']['recent_window'])
+		# a BloomFilter of every invoking and reply message ID in the replies table, or None until it's loaded
+		self.reply_filter = None
+		# the filter being loaded, if any, which must also receive any new IDs
+		self._next_reply_filter = None
+
+		# set once the emote_usage_history partitions for this month and the next have been created
+		self._emote_usage_history_ready = asyncio.Event()
+
+		# the emote cache and moderators are loaded by the invalidation bus once it's listening for changes to them
 		self.tasks = [
 			self.bot.loop.create_task(meth()) for meth in (
-				self.find_backend_guilds, self.leave_blacklisted_guilds)]
+				self.find_backend_guilds, self.leave_blacklisted_guilds,
+				self.flush_emote_usage_loop, self.load_reply_filter)]
 		self.tasks.append(self.decay_loop.start())
+		self.tasks.append(self.prune_replies_loop.start())
+		self.tasks.append(self.maintain_emote_usage_history_loop.start())
+		self.tasks.append(self.audit_loop.start())
 
 		self.logger = ObjectProxy(lambda: bot.cogs['Logger'])
 
 		self.guild_ids = set()
 		self.have_guilds = asyncio.Event()
 
+		# a frozenset of the IDs in the moderators table, or None until it's loaded
+		self.moderators = None
+		self._moderators_generation = 0
+
+		# IDs of emotes changed by another process whose cached copies are yet to be refreshed
+		self._stale_emote_ids = set()
+		# IDs of emotes which this process is deleting from the backend guilds and then the database
+		self._deleting_emote_ids = set()
+		self._emote_refresh_task = None
+
+		bus = self.bot.invalidation_bus
+		bus.add_handler(self, 'emotes', self._invalidate_emote, self.warm_emote_cache)
+		for table_name, cache in self.opt_caches.items():
+			bus.add_handler(
+				self, table_name, functools.partial(self._invalidate_cached_opt, table_name), self._clear_opt_caches)
+		# moderators are only ever added or removed by hand, perhaps with ec/sql, which runs on our own pool
+		bus.add_handler(self, 'moderators', self._invalidate_moderator, self.load_moderators, own_changes=True)
+
 	def _process_decay_config(self):
 		# example: {'enabled': True, 'cutoff': {'time': datetime.timedelta(...), 'usage': 3}}
 		decay_settings = self.bot.config.get('decay', False)
@@ -179,10 +613,55 @@ class Database(commands.Cog):
 		cutoff_settings.setdefault('time', datetime.timedelta(weeks=4))
 		cutoff_settings.setdefault('usage', 2)
 
+		# how many decayed emotes to remove from the database and log together
+		decay_settings.setdefault('batch_size', 100)
+
+	def _process_usage_logging_config(self):
+		# example: {'flush_interval': 10.0, 'flush_threshold': 500, 'max_buffered': 50_000}
+		usage_logging_settings = self.bot.config.setdefault('usage_logging', {})
+		usage_logging_settings.setdefault('flush_interval', 10.0)
+		usage_logging_settings.setdefault('flush_threshold', 500)
+		usage_logging_settings.setdefault('max_buffered', 50_000)
+		# individual uses older than this are deleted, a month at a time. the daily totals are kept forever.
+		usage_logging_settings.setdefault('raw_retention', datetime.timedelta(weeks=4))
+
+	def _process_emote_creation_config(self):
+		self.bot.config.setdefault('max_concurrent_emote_creations', 5)
+		# emotes are deleted from each backend guild one at a time, to stay within its rate limit,
+		# but from up to this many backend guilds at once
+		self.bot.config.setdefault('max_concurrent_emote_deletions', 5)
+
+	def _process_opt_cache_config(self):
+		# example: {'size': 10_000, 'ttl': 600}
+		opt_cache_settings = self.bot.config.setdefault('opt_cache', {})
+		# per table
+		opt_cache_settings.setdefault('size', 10_000)
+		# seconds. bounds how stale an entry can get if another process edits the table.
+		opt_cache_settings.setdefault('ttl', 600)
+
+	def _process_replies_config(self):
+		# example: {'recent_window': datetime.timedelta(hours=1), 'max_age': datetime.timedelta(weeks=2)}
+		replies_settings = self.bot.config.setdefault('replies', {})
+		# replies younger than this are also kept in memory
+		replies_settings.setdefault('recent_window', datetime.timedelta(hours=1))
+		# replies older than this are forgotten, so edits to or deletions of their messages are ignored
+		replies_settings.setdefault('max_age', datetime.timedelta(weeks=2))
+		# how many message IDs the filter of replied to messages is sized for. two are stored per reply.
+		replies_settings.setdefault('filter_capacity', 1_000_000)
+
 	def cog_unload(self):
 		for task in self.tasks:
 			task.cancel()
 
+		self.bot.invalidation_bus.remove_handlers(self)
+
+		logging.getLogger('discord.http').removeHandler(self._rate_limit_handler)
+
+		if self.usage_buffer:
+			# the bot flushes the buffer itself before closing the pool on shutdown,
+			# so this only matters when the extension is reloaded
+			self.bot.loop.create_task(self.flush_emote_usage())
+
 	## Tasks
 
 	async def find_backend_guilds(self):
@@ -195,9 +674,18 @@ class Database(commands.Cog):
 		guild_ids = {guild.id for guild in self.bot.guilds if self.is_backend_guild(guild)}
 
 		self.guild_ids.update(guild_ids)
-		self.have_guilds.set()
 		await self.bot.pool.executemany(self.queries.add_guild(), ((id,) for id in self.guild_ids))
 
+		for id, static_usage, animated_usage, last_creation in await self.bot.pool.fetch(self.queries.guild_usage()):
+			guild = self.bot.get_guild(id)
+			if guild is None or id not in self.guild_ids:
+				continue
+			self.slots.add_guild(
+				id, guild.emoji_limit, static_usage, animated_usage,
+				0.0 if last_creation is None else last_creation.timestamp())
+
+		self.have_guilds.set()
+
 		logger.info('In %s backend guilds.', len(self.guilds))
 
 		# allow other cogs that depend on the list of backend guilds to know when they've been found
@@ -217,6 +705,21 @@ class Database(commands.Cog):
 				continue
 			await guild.leave()
 
+	async def warm_emote_cache(self):
+		"""Load every emote into the emote cache, so that looking them up by name doesn't need a query."""
+		async def all_emotes():
+			return map(DatabaseEmote, await self.bot.pool.fetch(self.queries.all_emotes()))
+
+		await self.emote_cache.load(all_emotes())
+		logger.info('Cached %s emotes.', len(self.emote_cache))
+
+	async def flush_emote_usage_loop(self):
+		await self._emote_usage_history_ready.wait()
+		while True:
+			await asyncio.sleep(self.bot.config['usage_logging']['flush_interval'])
+			# don't lose the records being written if this task is cancelled in the middle of a flush
+			await asyncio.shield(self.flush_emote_usage())
+
 	@tasks.loop(minutes=10.0)
 	async def decay_loop(self):
 		if not self.bot.config['decay']['enabled']:
@@ -225,62 +728,356 @@ class Database(commands.Cog):
 		await self.bot.wait_until_ready()
 		await self.decay()
 
+	@tasks.loop(hours=24.0)
+	async def maintain_emote_usage_history_loop(self):
+		"""create the monthly emote_usage_history partitions for this month and the next,
+		and drop those which only hold uses older than the configured retention.
+		The daily totals of dropped uses remain in emote_usage_rollup.
+		Emote uses are not flushed until this has run once.
+		"""
+		try:
+			await self._maintain_emote_usage_history()
+		except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError) as exception:
+			# letting this propagate would stop the loop for good, and no more partitions would ever be created
+			logger.error('maintaining the emote usage history partitions failed: %s', exception)
+		finally:
+			self._emote_usage_history_ready.set()
+
+	async def _maintain_emote_usage_history(self):
+		today = datetime.datetime.utcnow().date()
+		partitions = {name for name, in await self.bot.pool.fetch(self.queries.emote_usage_history_partitions())}
+		this_month = today.replace(day=1)
+		for month in this_month, self._add_months(this_month, 1):
+			name = self._emote_usage_history_partition_name(month)
+			if name in partitions:
+				continue
+			try:
+				await self._create_emote_usage_history_partition(name, month)
+			except asyncpg.PostgresError as exception:
+				# uses for that month go to the default partition meanwhile, and are moved on the next attempt
+				logger.error('creating emote usage history partition %s failed: %s', name, exception)
+
+		cutoff = today - self.bot.config['usage_logging']['raw_retention']
+		for name in partitions:
+			match = self.EMOTE_USAGE_HISTORY_PARTITION_RE.fullmatch(name)
+			if match is None:
+				# the default partition
+				continue
+
+			month = datetime.date(int(match['year']), int(match['month']), 1)
+			if self._add_months(month, 1) <= cutoff:
+				await self.bot.pool.execute(self.queries.drop_emote_usage_history_partition(name))
+				logger.info('dropped emote usage history partition %s', name)
+
+	async def _create_emote_usage_history_partition(self, name, month):
+		"""create the emote_usage_history partition for month,
+		moving any uses from that month out of the default partition, which would otherwise prevent it
+		"""
+		start, end = month, self._add_months(month, 1)
+		bounds = [datetime.datetime.combine(date, datetime.time(), datetime.timezone.utc) for date in (start, end)]
+
+		async with self.bot.pool.acquire() as conn, conn.transaction():
+			# no more uses of that month may go to the default partition until the new one is attached
+			await conn.execute(self.queries.lock_default_emote_usage_history())
+			if not await conn.fetchval(self.queries.default_emote_usage_history_has_rows(), *bounds):
+				await conn.execute(self.queries.create_emote_usage_history_partition(name, start, end))
+				return
+
+			await conn.execute(self.queries.create_detached_emote_usage_history_partition(name))
+			status = await conn.execute(self.queries.move_default_emote_usage_history(name), *bounds)
+			await conn.execute(self.queries.attach_emote_usage_history_partition(name, start, end))
+
+		# INSERT 0 n
+		logger.warning('moved %s uses from the default emote usage history partition to %s', status.split()[-1], name)
+
+	EMOTE_USAGE_HISTORY_PARTITION_RE = re.compile(r'emote_usage_history_(?P<year>\d{4})_(?P<month>\d{2})')
+
+	@staticmethod
+	def _emote_usage_history_partition_name(month: datetime.date):
+		return f'emote_usage_history_{month.year:04}_{month.month:02}'
+
+	@staticmethod
+	def _add_months(month: datetime.date, n):
+		"""return the first day of the month n months after month"""
+		year, month_index = divmod(month.year * 12 + month.month - 1 + n, 12)
+		return datetime.date(year, month_index + 1, 1)
+
+	async def load_reply_filter(self):
+		"""(re)build the reply filter from the replies table"""
+		count = await self.bot.pool.fetchval(self.queries.count_replies())
+		# leave room for the replies that will be added until the next rebuild
+		capacity = max(self.bot.config['replies']['filter_capacity'], 4 * count)
+		self._next_reply_filter = reply_filter = utils.bloom.BloomFilter(capacity)
+
+		try:
+			async with self.bot.pool.acquire() as conn, conn.transaction():
+				async for invoking_message, reply_message in conn.cursor(self.queries.all_reply_message_ids()):
+					reply_filter.add(invoking_message)
+					reply_filter.add(reply_message)
+		finally:
+			self._next_reply_filter = None
+
+		self.reply_filter = reply_filter
+		logger.info('Loaded %s replied to message IDs into the reply filter.', reply_filter.count)
+
+	@tasks.loop(hours=1.0)
+	async def prune_replies_loop(self):
+		self.recent_replies.prune()
+		await self.prune_replies()
+		# the pruned IDs are still in the filter, so it only gets rebuilt once it has too many false positives
+		if self.reply_filter is not None and self.reply_filter.is_full():
+			await self.load_reply_filter()
+
+	async def prune_replies(self):
+		"""delete all replies older than the configured max age"""
+		cutoff = datetime.datetime.utcnow() - self.bot.config['replies']['max_age']
+		# message IDs are snowflakes, which start with their creation time
+		await self.bot.pool.execute(self.queries.prune_replies(), discord.utils.time_snowflake(cutoff))
+
+	## Cache invalidation
+
+	def _invalidate_emote(self, id):
+		self._stale_emote_ids.add(id)
+		if self._emote_refresh_task is None or self._emote_refresh_task.done():
+			self._emote_refresh_task = self.bot.loop.create_task(self._refresh_stale_emotes())
+
+	async def _refresh_stale_emotes(self):
+		"""bring the cached copies of emotes changed by other processes up to date, in batches"""
+		while self._stale_emote_ids:
+			ids, self._stale_emote_ids = self._stale_emote_ids, set()
+			rows = await self.bot.pool.fetch(self.queries.get_emotes_by_id(), list(ids))
+			for row in rows:
+				# until the cache is warm, any emote may be missing from it
+				if self.emote_cache.ready.is_set() and self.emote_cache.get_by_id(row['id']) is None:
+					# created by another process, in a slot it allocated
+					self.slots.use(row['guild'], row['animated'])
+				self._update_cached_emote(row)
+
+			for id in ids - {row['id'] for row in rows}:
+				emote = self.emote_cache.get_by_id(id)
+				# if it's no longer cached, whoever removed it from the cache also released its slot
+				if emote is not None:
+					self.emote_cache.discard(id)
+					self.slots.release(emote.guild, emote.animated)
+
+	async def _clear_opt_caches(self):
+		for table_name, cache in self.opt_caches.items():
+			self._opt_generations[table_name] += 1
+			cache.clear()
+
+	def _invalidate_moderator(self, id):
+		self.bot.loop.create_task(self.load_moderators())
+
+	async def load_moderators(self):
+		self._moderators_generation += 1
+		generation = self._moderators_generation
+		moderators = frozenset(id for id, in await self.bot.pool.fetch(self.queries.moderators()))
+		# a load that started later has newer data
+		if generation == self._moderators_generation:
+			self.moderators = moderators
+
 	## Events
 
 	@commands.Cog.listener()
 	async def on_guild_remove(self, guild):
 		await self.bot.pool.execute(self.queries.delete_guild(), guild.id)
-		with contextlib.suppress(AttributeError):
-			self.guilds.discard(guild)
+		# the emotes in a backend guild are deleted along with it
+		self.emote_cache.discard_guild(guild.id)
+		self.slots.remove_guild(guild.id)
+		self.guild_ids.discard(guild.id)
 
 	@commands.Cog.listener()
 	async def on_guild_join(self, guild):
 		if self.is_backend_guild(guild):
 			await self.bot.pool.execute(self.queries.add_guild(), guild.id)
-			self.guilds.add(guild)
+			self.guild_ids.add(guild.id)
+			animated_usage = sum(emoji.animated for emoji in guild.emojis)
+			self.slots.add_guild(guild.id, guild.emoji_limit, len(guild.emojis) - animated_usage, animated_usage)
 			self.bot.dispatch('backend_guild_join', guild)
 		elif await self.get_guild_blacklist(guild.id):
 			await guild.leave()
 
+	@commands.Cog.listener()
+	async def on_guild_update(self, before, after):
+		if after.id in self.guild_ids and before.emoji_limit != after.emoji_limit:
+			self.slots.set_limit(after.id, after.emoji_limit)
+
+	@commands.Cog.listener()
+	async def on_guild_emojis_update(self, guild, before, after):
+		"""apply changes to the emotes in a backend guild, whoever made them, to the database"""
+		if guild.id not in self.guild_ids:
+			return
+
+		after_by_id = {emoji.id: emoji for emoji in after}
+		removed = [
+			emoji.id for emoji in before
+			# our own deletions remove their rows themselves, and need to know which rows they removed
+			if emoji.id not in after_by_id and emoji.id not in self._deleting_emote_ids]
+		if removed:
+			removed = self._forget_removed_emotes(await self.bot.pool.fetch(self.queries.remove_emotes(), removed))
+			if removed:
+				logger.info('removed %s emotes deleted from backend guild %s', len(removed), guild.id)
+
+		before_names = {emoji.id: emoji.name for emoji in before}
+		for emoji in after:
+			if emoji.id not in before_names or before_names[emoji.id] == emoji.name:
+				# new emotes are inserted by create_emote, which is the only thing that knows their author
+				continue
+
+			try:
+				row = await self.bot.pool.fetchrow(self.queries.sync_emote_name(), emoji.id, emoji.name)
+			except asyncpg.UniqueViolationError:
+				logger.warning('backend emote %s was renamed to %s, which is taken', emoji.id, emoji.name)
+				continue
+			if row is not None:
+				self._update_cached_emote(row)
+
+	@tasks.loop(hours=1.0)
+	async def audit_loop(self):
+		"""repair any drift between the backend guilds and the database that on_guild_emojis_update missed"""
+		await self.bot.wait_until_ready()
+		await self.have_guilds.wait()
+
+		non_db, non_backend, unseen_guild_ids = await self.desynced_emotes()
+		if unseen_guild_ids:
+			# they may belong to another process, or be temporarily unavailable, so never delete their rows
+			logger.warning(
+				'not auditing the emotes of %s guilds which are not available backend guilds: %s',
+				len(unseen_guild_ids), ', '.join(map(str, unseen_guild_ids)))
+		if non_backend:
+			removed = self._forget_removed_emotes(await self.bot.pool.fetch(
+				self.queries.remove_emotes(), [emote.id for emote in non_backend]))
+			logger.warning(
+				'removed %s emotes which were missing from the backend guilds: %s',
+				len(removed), ', '.join(emote.name for emote in non_backend if emote.id in removed))
+		if non_db:
+			logger.warning(
+				'%s backend emotes are missing from the database: %s',
+				len(non_db), ', '.join(f'{emoji.name} ({emoji.id})' for emoji in non_db))
+
 	## Informational
 
-	async def free_guild(self, animated=False):
-		"""Find a guild in the backend guilds suitable for storing an emote.
+	# emotes created more recently than this may not be in the gateway cache yet, so the audit ignores them
+	AUDIT_GRACE_PERIOD = datetime.timedelta(minutes=5)
+
+	async def desynced_emotes(self):
+		"""return a list of backend guild emojis missing from the database,
+		a list of DatabaseEmotes missing from the backend guilds,
+		and a list of the IDs of guilds which have emotes in the database but whose emojis we can't see.
+
+		Only available backend guilds are audited, and only those whose checksum of emote IDs differs from
+		the database's are compared emote by emote.
+		"""
+		db_checksums = dict(await self.bot.pool.fetch(self.queries.guild_emote_checksums()))
+		grace_cutoff = discord.utils.time_snowflake(datetime.datetime.utcnow() - self.AUDIT_GRACE_PERIOD)
+
+		non_db, non_backend, unseen_guild_ids = [], [], []
+		for guild_id in self.guild_ids | db_checksums.keys():
+			guild = self.bot.get_guild(guild_id)
+			if guild is None or guild.unavailable or guild_id not in self.guild_ids:
+				# its emojis are unknown, not empty
+				if guild_id in db_checksums:
+					unseen_guild_ids.append(guild_id)
+				continue
+
+			backend = {emoji.id: emoji for emoji in guild.emojis}
+			if self.emote_id_checksum(backend) == db_checksums.get(guild_id):
+				continue
+
+			db = {
+				emote.id: emote
+				for emote in map(DatabaseEmote, await self.bot.pool.fetch(self.queries.guild_emotes(), guild_id))}
+			non_db.extend(emoji for id, emoji in backend.items() if id not in db and id < grace_cutoff)
+			non_backend.extend(
+				emote for id, emote in db.items()
+				if id not in backend and id < grace_cutoff and id not in self._deleting_emote_ids)
 
-		As the number of emotes stored by the bot increases, the probability of finding a rate-limited
-		guild approaches 1, but until then, this should work pretty well.
+		return non_db, non_backend, unseen_guild_ids
+
+	@staticmethod
+	def emote_id_checksum(ids):
+		"""return the same checksum of a set of emote IDs as the guild_emote_checksums query,
+		or None if there are no IDs
 		"""
+		if not ids:
+			return None
+		return hashlib.md5(','.join(map(str, sorted(ids))).encode()).hexdigest()
+
+	async def free_guild(self, animated=False):
+		"""Reserve a slot in the backend guilds suitable for storing an emote and return its guild ID.
+		If the slot ends up unused, it must be given back with self.slots.release.
 
-		# random() hopefully lets us bypass emote rate limits
-		# otherwise if we always pick the first available gulid,
-		# we might reuse it often and get rate limited.
-		guild_id = await self.bot.pool.fetchval(self.queries.free_guild(animated))
+		If every guild with a free slot is rate limited, this waits for the one whose limit expires first.
+		"""
+		await self.have_guilds.wait()
+		guild_id = self.slots.allocate(animated)
 
-		if guild_id is None:
-			raise errors.NoMoreSlotsError
+		delay = self.slots.ready_at(guild_id) - time.time()
+		if delay > 0:
+			try:
+				await asyncio.sleep(delay)
+			except BaseException:
+				self.slots.release(guild_id, animated)
+				raise
 
 		return guild_id
 
-	async def count(self) -> asyncpg.Record:
-		"""Return (not animated count, animated count, total)"""
-		return await self.bot.pool.fetchrow(self.queries.count())
+	def _on_emoji_creation_rate_limit(self, guild_id, retry_after):
+		logger.info('emote creation in guild %s is rate limited for %.2f seconds', guild_id, retry_after)
+		self.slots.defer(guild_id, time.time() + retry_after)
+
+	def _on_emoji_deletion_rate_limit(self, guild_id, retry_after):
+		logger.info('emote deletion in guild %s is rate limited for %.2f seconds', guild_id, retry_after)
+		self._deletion_ready_at[guild_id] = max(self._deletion_ready_at.get(guild_id, 0.0), time.time() + retry_after)
+
+	async def count(self) -> EmoteCounts:
+		"""Return (not animated count, animated count, NSFW count, total)"""
+		if self.emote_cache.ready.is_set():
+			return self.emote_cache.counts()
+		return EmoteCounts(*await self.bot.pool.fetchrow(self.queries.count()))
 
 	def capacity(self):
 		"""return a three-tuple of static capacity, animated, total"""
-		return (len(self.guilds) * 50,) * 2 + (len(self.guilds) * 50 * 2,)
+		return self.slots.capacity()
 
 	async def get_emote(self, name) -> DatabaseEmote:
 		"""get an emote object by name"""
+		emote = self.emote_cache.get(name)
+		if emote is not None:
+			return emote
+		if self.emote_cache.ready.is_set():
+			raise errors.EmoteNotFoundError(name)
+
 		# we use LOWER(name) = LOWER($1) instead of ILIKE because ILIKE has some wildcarding stuff
 		# that we don't want
 		# probably LOWER(name) = $1, name.lower() would also work, but this looks cleaner
 		# and keeps the lowercasing behavior consistent
 		result = await self.bot.pool.fetchrow(self.queries.get_emote(), name)
 		if result:
-			return DatabaseEmote(result)
+			return self._update_cached_emote(result)
 		else:
 			raise errors.EmoteNotFoundError(name)
 
+	async def get_emotes(self, names) -> typing.Dict[str, DatabaseEmote]:
+		"""get several emotes by name using at most one query.
+		return a dict mapping the lowercased name of each emote that was found to that emote.
+		"""
+		found = {}
+		missing = []
+		for name in {name.lower() for name in names}:
+			emote = self.emote_cache.get(name)
+			if emote is None:
+				missing.append(name)
+			else:
+				found[name] = emote
+
+		if missing and not self.emote_cache.ready.is_set():
+			for row in await self.bot.pool.fetch(self.queries.get_emotes(), missing):
+				emote = self._update_cached_emote(row)
+				found[emote.name.lower()] = emote
+
+		return found
+
 	def get_emote_usage(self, emote) -> int:
 		"""return how many times this emote was used"""
 		cutoff_time = datetime.datetime.utcnow() - self.bot.config['decay']['cutoff']['time']
@@ -289,6 +1086,12 @@ class Database(commands.Cog):
 	async def get_reply_message(self, invoking_message):
 		"""return a tuple of message_type, reply_message_id for the given invoking message ID
 		or None, None if not found"""
+		reply = self.recent_replies.get(invoking_message)
+		if reply is not None:
+			return reply
+		if not self.may_have_reply(invoking_message):
+			return None, None
+
 		row = await self.bot.pool.fetchrow(self.queries.get_reply_message(), invoking_message)
 		if row is None:
 			return None, None
@@ -319,8 +1122,11 @@ class Database(commands.Cog):
 		*,
 		allow_nsfw: AllowNsfwType = False,
 		page: PageSpecifier = PageSpecifier.first(),
-		limit: int = 100, debug=False
+		limit: int = 100, offset: int = 0, debug=False
 	):
+		"""return up to limit emotes, sorted by name, starting from page.
+		offset skips that many emotes first. It costs as much as fetching them, so only use it to jump ahead.
+		"""
 		args = [self.allowed_nsfw_types(allow_nsfw)]
 
 		sort_order = 'DESC' if page.direction is PageDirection.before else 'ASC'
@@ -337,6 +1143,10 @@ class Database(commands.Cog):
 
 		args.append(min(max(limit, 1), 250))
 
+		if offset:
+			kwargs['offset'] = True
+			args.append(offset)
+
 		if debug:
 			return self.queries.all_emotes_keyset(**kwargs), args
 
@@ -347,6 +1157,19 @@ class Database(commands.Cog):
 			results.reverse()
 		return results
 
+	async def count_emotes(self, author_id=None, *, allow_nsfw: AllowNsfwType = False) -> int:
+		"""return how many emotes all_emotes would return given the same arguments"""
+		allowed_nsfw_types = self.allowed_nsfw_types(allow_nsfw)
+		if author_id is None:
+			if self.emote_cache.ready.is_set():
+				counts = self.emote_cache.counts()
+				return counts.total if 'SELF_NSFW' in allowed_nsfw_types else counts.total - counts.nsfw
+			return await self.bot.pool.fetchval(self.queries.count_emotes(), allowed_nsfw_types)
+
+		# this one can use the author index, rather than scanning the whole table
+		return await self.bot.pool.fetchval(
+			self.queries.count_emotes(filter_author=True), allowed_nsfw_types, author_id)
+
 	def popular_emotes(self, author_id=None, *, limit=200, allow_nsfw: AllowNsfwType = False):
 		"""return an async iterator that gets emotes from the db sorted by popularity"""
 		cutoff_time = datetime.datetime.utcnow() - self.bot.config['decay']['cutoff']['time']
@@ -356,9 +1179,15 @@ class Database(commands.Cog):
 			self.queries.popular_emotes(filter_author=bool(extra_args)),
 			cutoff_time, limit, self.allowed_nsfw_types(allow_nsfw), *extra_args)
 
-	def search(self, query, *, allow_nsfw: AllowNsfwType = False):
-		"""return an async iterator that gets emotes from the db whose name is similar to `query`."""
-		return self._database_emote_cursor(self.queries.search(), query, self.allowed_nsfw_types(allow_nsfw))
+	async def search(self, query, *, allow_nsfw: AllowNsfwType = False):
+		"""return a list of emotes whose name is similar to `query`, most similar first.
+		Until the emote cache is warm, at most 100 emotes are returned.
+		"""
+		allowed_nsfw_types = self.allowed_nsfw_types(allow_nsfw)
+		if self.emote_cache.ready.is_set():
+			return [emote for emote in self.emote_cache.search(query) if emote.nsfw.value in allowed_nsfw_types]
+
+		return list(map(DatabaseEmote, await self.bot.pool.fetch(self.queries.search(), query, allowed_nsfw_types)))
 
 	@classmethod
 	def allowed_nsfw_types(cls, allow_nsfw: AllowNsfwType):
@@ -373,20 +1202,31 @@ class Database(commands.Cog):
 			allow_nsfw = utils.channel_is_nsfw(allow_nsfw)
 		return ('SFW', 'SELF_NSFW', 'MOD_NSFW') if allow_nsfw else ('SFW',)
 
-	def decayable_emotes(self):
+	async def _check_emote_usage_rollup(self):
+		if not self._have_emote_usage_rollup:
+			try:
+				self._have_emote_usage_rollup = await self.bot.pool.fetchval(
+					self.queries.migration_applied(), 'emote_usage_rollup')
+			except asyncpg.UndefinedTableError:
+				# no migrations have been applied at all
+				pass
+		return self._have_emote_usage_rollup
+
+	async def decayable_emotes(self):
 		"""emotes that should be removed due to inactivity.
 
-		returns an async iterator over all emotes that:
+		returns a list of all emotes that:
 			- were created before `cutoff`, and
 			- have been used < `usage_threshold` between now and cutoff, and
 			- are not preserved
 
-		the cut off and usage threshold are specified in a dict at self.bot.config['decay'],
-		under subkeys 'cutoff_time' and 'cutoff_usage', respectively.
+		the cut off and usage threshold are specified in a dict at self.bot.config['decay']['cutoff'],
+		under subkeys 'time' and 'usage', respectively.
 		"""
 		cutoff_time = datetime.datetime.utcnow() - self.bot.config['decay']['cutoff']['time']
 		usage_threshold = self.bot.config['decay']['cutoff']['usage']
-		return self._database_emote_cursor(self.queries.decayable_emotes(), cutoff_time, usage_threshold)
+		return list(map(DatabaseEmote, await self.bot.pool.fetch(
+			self.queries.decayable_emotes(), cutoff_time, usage_threshold)))
 
 	async def blacklisted_guilds(self):
 		async for guild_id, in self._cursor(self.queries.blacklisted_guilds()):
@@ -421,11 +1261,11 @@ class Database(commands.Cog):
 			raise errors.EmoteExistsError(emote)
 
 	async def is_moderator(self, user_id):
-		# check the set first to avoid a query
-		# but also check the database in case we don't have access to the websocket and therefore the client cache
-		return (
-			await self.bot.is_owner(discord.Object(user_id))
-			or await self.bot.pool.fetchval('SELECT true FROM moderators WHERE id = $1', user_id))
+		if self.moderators is None:
+			is_moderator = await self.bot.pool.fetchval(self.queries.is_moderator(), user_id)
+		else:
+			is_moderator = user_id in self.moderators
+		return is_moderator or await self.bot.is_owner(discord.Object(user_id))
 
 	async def is_owner(self, emote, user_id, *, force=False):
 		"""return whether the user has permissions to modify this emote
@@ -451,12 +1291,37 @@ class Database(commands.Cog):
 	async def create_emote(self, name, author_id, animated, image_data: bytes):
 		await self.ensure_emote_does_not_exist(name)
 
-		guild_id = await self.free_guild(animated)
 		image = image_utils.image_to_base64_url(image_data)
 
-		emote_data = await self.bot.http.create_custom_emoji(guild_id=guild_id, name=name, image=image)
-		return DatabaseEmote(await self.bot.pool.fetchrow(
-			self.queries.create_emote(), name, int(emote_data['id']), author_id, animated, guild_id))
+		async with self._emote_creation_semaphore:
+			guild_id = await self.free_guild(animated)
+			try:
+				emote_data = await self.bot.http.create_custom_emoji(guild_id=guild_id, name=name, image=image)
+			except BaseException:
+				self.slots.release(guild_id, animated)
+				raise
+
+		emote_id = int(emote_data['id'])
+		try:
+			row = await self.bot.pool.fetchrow(
+				self.queries.create_emote(), name, emote_id, author_id, animated, guild_id)
+		except BaseException as exception:
+			# e.g. an emote with the same name was created since we checked. don't leave an orphaned emoji behind.
+			with self._deleting([emote_id]):
+				try:
+					await self.bot.http.delete_custom_emoji(guild_id, emote_id)
+				except discord.HTTPException as delete_exception:
+					logger.error(
+						'deleting orphaned emote %s failed: %s',
+						emote_id, utils.format_http_exception(delete_exception))
+			self.slots.release(guild_id, animated)
+			if isinstance(exception, asyncpg.UniqueViolationError):
+				# another process may have created it, in which case it may not be cached yet
+				row = await self.bot.pool.fetchrow(self.queries.get_emote(), name)
+				raise errors.EmoteExistsError(None if row is None else DatabaseEmote(row), name) from exception
+			raise
+
+		return self._update_cached_emote(row)
 
 	async def remove_emote(self, emote, user_id, *, force=False):
 		"""Remove an emote given by name or DatabaseEmote object.
@@ -473,16 +1338,15 @@ class Database(commands.Cog):
 
 		await self.owner_check(emote, user_id, force=force)
 
-		try:
-			await self.bot.http.delete_custom_emoji(emote.guild, emote.id)
-		except discord.NotFound:
-			# sometimes the database and the backend get out of sync
-			# but we don't really care if there's an entry in the database and not the backend
-			logger.warning(f'emote {emote.name} found in the database but not the backend! removing anyway.')
-
-		tag = await self.bot.pool.execute(self.queries.remove_emote(), emote.id)
-		if tag != 'DELETE 1':
-			raise AssertionError
+		with self._deleting([emote.id]):
+			try:
+				await self.bot.http.delete_custom_emoji(emote.guild, emote.id)
+			except discord.NotFound:
+				# sometimes the database and the backend get out of sync
+				# but we don't really care if there's an entry in the database and not the backend
+				logger.warning(f'emote {emote.name} found in the database but not the backend! removing anyway.')
+
+			self._forget_removed_emotes(await self.bot.pool.fetch(self.queries.remove_emotes(), [emote.id]))
 		return emote
 
 	async def rename_emote(self, old_name, new_name, user_id):
@@ -496,13 +1360,15 @@ class Database(commands.Cog):
 		await self.owner_check(emote, user_id)
 
 		await self.bot.http.edit_custom_emoji(emote.guild, emote.id, name=new_name)
-		return DatabaseEmote(await self.bot.pool.fetchrow(self.queries.rename_emote(), emote.id, new_name))
+		return self._update_cached_emote(
+			await self.bot.pool.fetchrow(self.queries.rename_emote(), emote.id, new_name))
 
 	async def set_emote_creation(self, name, time: datetime):
 		"""Set the creation time of an emote."""
-		tag = await self.bot.pool.execute(self.queries.set_emote_creation(), name, time)
-		if tag == 'UPDATE 0':
+		row = await self.bot.pool.fetchrow(self.queries.set_emote_creation(), name, time)
+		if row is None:
 			raise errors.EmoteNotFoundError(name)
+		self._update_cached_emote(row)
 
 	async def set_emote_description(self, name, description=None, user_id=None):
 		"""Set an emote's description.
@@ -518,7 +1384,7 @@ class Database(commands.Cog):
 		await self.owner_check(emote, user_id)
 
 		try:
-			return DatabaseEmote(await self.bot.pool.fetchrow(
+			return self._update_cached_emote(await self.bot.pool.fetchrow(
 				self.queries.set_emote_description(), emote.id, description))
 		except asyncpg.StringDataRightTruncationError as exception:
 			# dumb way to do it but it's the only way i've got
@@ -537,7 +1403,7 @@ class Database(commands.Cog):
 		if not emote:
 			raise errors.EmoteNotFoundError(name)
 		else:
-			return DatabaseEmote(emote)
+			return self._update_cached_emote(emote)
 
 	async def toggle_emote_nsfw(self, emote: DatabaseEmote, *, by_mod=False):
 		new_state = not emote.is_nsfw
@@ -546,69 +1412,302 @@ class Database(commands.Cog):
 	async def set_emote_nsfw(self, emote: DatabaseEmote, new_state: bool, *, by_mod=False):
 		new_status = self.new_nsfw_status(emote, new_state, by_mod=by_mod)
 
-		return DatabaseEmote(await self.bot.pool.fetchrow(self.queries.set_emote_nsfw(), emote.id, new_status))
+		return self._update_cached_emote(
+			await self.bot.pool.fetchrow(self.queries.set_emote_nsfw(), emote.id, new_status.value))
+
+	def _update_cached_emote(self, row):
+		"""wrap an emotes row in a DatabaseEmote and replace the cached copy of that emote with it"""
+		emote = DatabaseEmote(row)
+		self.emote_cache.update(emote)
+		return emote
 
 	@staticmethod
 	def new_nsfw_status(emote, desired_status: bool, *, by_mod=False):
 		if by_mod:
 			# mods can do anything
-			return 'MOD_NSFW' if desired_status else 'SFW'
+			return NsfwStatus.mod_nsfw if desired_status else NsfwStatus.sfw
 		elif desired_status:
-			return 'SELF_NSFW'
+			return NsfwStatus.self_nsfw
 
 		# not by mod and SFW
-		if emote.nsfw == 'MOD_NSFW':
+		if emote.nsfw is NsfwStatus.mod_nsfw:
 			raise errors.PermissionDeniedError(
 				_('You may not set this emote as SFW because it was set NSFW by an emote moderator.'))
-		if emote.nsfw == 'SELF_NSFW':
-			return 'SFW'
+		return NsfwStatus.sfw
 
+	@optional_connection
 	async def delete_user_account(self, user_id):
-		await self.delete_all_user_emotes(user_id)
+		"""delete everything but the emotes of user_id, which must be deleted first using delete_all_user_emotes.
+		This only runs SQL, so it's safe to call inside a transaction.
+		"""
 		await self.delete_all_user_state(user_id)
 
-	async def delete_all_user_emotes(self, user_id):
-		async for emote in self.all_emotes(user_id):
-			with contextlib.suppress(errors.EmoteError):
-				# since we're only listing emotes by user_id,
-				# we don't need to perform another ownership check
-				# TODO use DELETE FROM
-				await self.remove_emote(emote, user_id=None)
+	async def delete_all_user_emotes(self, user_id, *, progress=None):
+		"""delete every emote made by user_id from the backend guilds and then from the database.
+		If given, progress(deleted, total) is awaited after each emote is deleted from its backend guild.
+		return the number of emotes deleted.
 
-	async def log_emote_use(self, emote_id):
-		await self.bot.pool.execute(self.queries.log_emote_use(), emote_id)
+		No connection is held during the backend deletions, so don't call this inside a transaction.
+		"""
+		emotes = list(map(DatabaseEmote, await self.bot.pool.fetch(self.queries.all_user_emotes(), user_id)))
+		if not emotes:
+			return 0
 
-	async def decay(self):
-		async for emote in self.decayable_emotes():
-			logger.debug('decaying %s', emote.name)
-			removal_messages = await self.logger.on_emote_decay(emote)
+		deleted = []
+
+		async def on_deleted(emote):
+			deleted.append(emote)
+			if progress is not None:
+				await progress(len(deleted), len(emotes))
+
+		with self._deleting(emote.id for emote in emotes):
 			try:
-				await self.remove_emote(emote, user_id=None)
-			except (errors.ConnoisseurError, errors.DiscordError) as ex:
-				logger.error('decaying %s failed due to %s', emote.name, ex)
-				await asyncio.gather(*map(operator.methodcaller('delete'), removal_messages), return_exceptions=True)
+				await self._delete_backend_emotes(emotes, on_deleted)
+			finally:
+				self._forget_removed_emotes(await self.bot.pool.fetch(
+					self.queries.remove_emotes(), [emote.id for emote in deleted]))
+
+		return len(deleted)
+
+	def log_emote_use(self, emote_id):
+		"""record that an emote was used. The use is buffered and written to the database later."""
+		self.usage_buffer.append((emote_id, datetime.datetime.now(datetime.timezone.utc)))
+		self._trim_usage_buffer()
+
+		if (
+			len(self.usage_buffer) >= self.bot.config['usage_logging']['flush_threshold']
+			and self._emote_usage_history_ready.is_set()
+			and (self._usage_flush_task is None or self._usage_flush_task.done())
+		):
+			self._usage_flush_task = self.bot.loop.create_task(self.flush_emote_usage())
+
+	async def flush_emote_usage(self):
+		"""write all buffered emote uses to the database.
+		If that fails, they're put back in the buffer to be retried on the next flush.
+		"""
+		records, self.usage_buffer = self.usage_buffer, []
+		if not records:
+			return
+
+		try:
+			async with self.bot.pool.acquire() as conn:
+				try:
+					await self._write_emote_usage(conn, records)
+				except asyncpg.ForeignKeyViolationError:
+					# some of these emotes were removed since they were used
+					ids = {id for id, in await conn.fetch(
+						self.queries.existing_emote_ids(), list({id for id, _ in records}))}
+					await self._write_emote_usage(conn, [record for record in records if record[0] in ids])
+		except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError) as exception:
+			logger.error('writing %s emote uses failed: %s', len(records), exception)
+			self.usage_buffer[:0] = records
+			self._trim_usage_buffer()
+
+	async def _write_emote_usage(self, conn, records):
+		"""write emote uses to the history and add them to the daily totals"""
+		if not records:
+			# e.g. every emote used was removed since
+			return
+
+		daily_uses = collections.Counter((id, used_at.date()) for id, used_at in records)
+		async with conn.transaction():
+			await conn.copy_records_to_table('emote_usage_history', records=records, columns=('id', 'time'))
+			await conn.execute(
+				self.queries.increment_emote_usage_rollup(),
+				*map(list, zip(*((id, day, uses) for (id, day), uses in daily_uses.items()))))
+
+	def _trim_usage_buffer(self):
+		"""enforce the configured limit on buffered emote uses by dropping the oldest ones"""
+		excess = len(self.usage_buffer) - self.bot.config['usage_logging']['max_buffered']
+		if excess > 0:
+			del self.usage_buffer[:excess]
+			logger.warning('dropped %s buffered emote uses', excess)
 
-	def add_reply_message(self, invoking_message, reply_type: MessageReplyType, reply_message):
+	async def decay(self):
+		"""remove every emote that was not used enough recently.
+		The emotes are removed from the database and logged in batches.
+		Nothing is removed until the emote_usage_rollup migration has been applied, since until then,
+		every emote would appear to be unused.
+		"""
+		if not await self._check_emote_usage_rollup():
+			logger.error(
+				'not decaying any emotes, since the emote_usage_rollup migration has not been applied. '
+				'see INSTALLATION.md.')
+			return
+
+		emotes = await self.decayable_emotes()
+		if not emotes:
+			return
+
+		logger.info('decaying %s emotes', len(emotes))
+
+		batch_size = self.bot.config['decay']['batch_size']
+		# emotes deleted from their backend guild but not yet from the database
+		decayed = []
+
+		async def flush():
+			nonlocal decayed
+			batch, decayed = decayed, []
+			if batch:
+				await self._remove_decayed_emotes(batch)
+
+		async def on_deleted(emote):
+			decayed.append(emote)
+			if len(decayed) >= batch_size:
+				await flush()
+
+		with self._deleting(emote.id for emote in emotes):
+			try:
+				await self._delete_backend_emotes(emotes, on_deleted)
+			finally:
+				# don't leave behind rows for emotes that no longer exist
+				await flush()
+
+	@contextlib.contextmanager
+	def _deleting(self, emote_ids):
+		"""mark emotes as being deleted by this process, so that on_guild_emojis_update leaves their rows to us"""
+		emote_ids = frozenset(emote_ids)
+		self._deleting_emote_ids.update(emote_ids)
+		try:
+			yield
+		finally:
+			self._deleting_emote_ids.difference_update(emote_ids)
+
+	async def _delete_backend_emotes(self, emotes, on_deleted):
+		"""delete emotes from their backend guilds, but not from the database.
+		Emotes are deleted from up to max_concurrent_emote_deletions guilds at once, one at a time per guild.
+		A guild known to be rate limited waits without taking up one of those places, so that others can go ahead.
+		on_deleted(emote) is awaited for each emote that was deleted, or that was already missing.
+		"""
+		emotes_by_guild = collections.defaultdict(list)
+		for emote in emotes:
+			emotes_by_guild[emote.guild].append(emote)
+
+		semaphore = asyncio.Semaphore(self.bot.config['max_concurrent_emote_deletions'])
+
+		async def delete_from_guild(guild_emotes):
+			for emote in guild_emotes:
+				await asyncio.sleep(self._deletion_ready_at.get(emote.guild, 0.0) - time.time())
+				async with semaphore:
+					# emote deletion is rate limited per guild. discord.py waits out any 429s for us.
+					try:
+						await self.bot.http.delete_custom_emoji(emote.guild, emote.id)
+					except discord.NotFound:
+						pass
+					except discord.HTTPException as exception:
+						logger.error('deleting %s failed due to %s', emote.name, utils.format_http_exception(exception))
+						continue
+
+				await on_deleted(emote)
+
+		# start with the guilds that aren't rate limited
+		guilds = sorted(emotes_by_guild, key=lambda guild_id: self._deletion_ready_at.get(guild_id, 0.0))
+		await asyncio.gather(*(delete_from_guild(emotes_by_guild[guild_id]) for guild_id in guilds))
+
+	def _forget_removed_emotes(self, rows):
+		"""remove emotes from the in-memory state given the rows returned by the remove_emotes query,
+		and return their IDs.
+		Since only the query which actually deleted a row returns it,
+		each emote is forgotten exactly once, even if several tasks race to remove it.
+		"""
+		for id, guild_id, animated in rows:
+			self.emote_cache.discard(id)
+			self.slots.release(guild_id, animated)
+		return {id for id, guild_id, animated in rows}
+
+	async def _remove_decayed_emotes(self, emotes):
+		self._forget_removed_emotes(
+			await self.bot.pool.fetch(self.queries.remove_emotes(), [emote.id for emote in emotes]))
+		# every one of these was deleted from the backend, even if something else already removed its row
+		logger.debug('decayed %s emotes', len(emotes))
+		await self.logger.on_emotes_decay(emotes)
+
+	def may_have_reply(self, message_id):
+		"""return False if message_id is definitely neither the invoking nor the reply message of any reply"""
+		if self.recent_replies.covers(message_id):
+			return message_id in self.recent_replies
+		return self.reply_filter is None or message_id in self.reply_filter
+
+	async def add_reply_message(self, invoking_message, reply_type: MessageReplyType, reply_message):
 		"""add a record to indicate that the message with ID invoking_message is a reply_type message and that
 		the bot replied with message ID reply_message
 		"""
-		return self.bot.pool.execute(
+		self.recent_replies.add(invoking_message, reply_type, reply_message)
+		for reply_filter in self.reply_filter, self._next_reply_filter:
+			if reply_filter is not None:
+				reply_filter.add(invoking_message)
+				reply_filter.add(reply_message)
+		await self.bot.pool.execute(
 			self.queries.add_reply_message(), invoking_message, reply_type.value, reply_message)
 
-	def delete_reply_by_invoking_message(self, invoking_message):
+	async def delete_reply_by_invoking_message(self, invoking_message):
 		"""remove and return one reply message ID for the given invoking message ID
 		return None if no reply message was found.
 		"""
-		return self.bot.pool.fetchval(self.queries.delete_reply_by_invoking_message(), invoking_message)
+		reply_message = self.recent_replies.pop_by_invoking(invoking_message)
+		if reply_message is None and not self.may_have_reply(invoking_message):
+			return None
 
-	def delete_reply_by_reply_message(self, reply_message):
+		deleted = await self.bot.pool.fetchval(self.queries.delete_reply_by_invoking_message(), invoking_message)
+		return reply_message or deleted
+
+	async def delete_reply_by_reply_message(self, reply_message):
 		"""remove one reply message entry for the given reply message ID"""
-		return self.bot.pool.execute(self.queries.delete_reply_by_reply_message(), reply_message)
+		if not self.recent_replies.pop_by_reply(reply_message) and not self.may_have_reply(reply_message):
+			return
+
+		await self.bot.pool.execute(self.queries.delete_reply_by_reply_message(), reply_message)
+
+	async def delete_replies(self, message_ids):
+		"""remove every reply whose invoking or reply message ID is in message_ids.
+		return the reply message IDs of those replies whose invoking message was given but whose reply was not.
+		"""
+		message_ids = [message_id for message_id in message_ids if self.may_have_reply(message_id)]
+		if not message_ids:
+			return []
+
+		for message_id in message_ids:
+			self.recent_replies.pop_by_invoking(message_id)
+			self.recent_replies.pop_by_reply(message_id)
+
+		message_id_set = frozenset(message_ids)
+		return [
+			reply_message
+			for invoking_message, reply_message in await self.bot.pool.fetch(self.queries.delete_replies(), message_ids)
+			if invoking_message in message_id_set and reply_message not in message_id_set]
 
 	## User / Guild Options
 
+	async def _get_opt(self, table_name, id) -> OptState:
+		"""return the state and blacklist reason for a user or guild, from the cache if possible"""
+		cache = self.opt_caches[table_name]
+		try:
+			return cache[id]
+		except KeyError:
+			pass
+
+		generation = self._opt_generations[table_name]
+		row = await self.bot.pool.fetchrow(self.queries.get_opt(table_name), id)
+		# most users never get a row, so cache their absence too
+		opt = NO_OPT_STATE if row is None else OptState(*row)
+		# if anything was written meanwhile, this row may be older than what was written
+		if generation == self._opt_generations[table_name]:
+			cache[id] = opt
+		return opt
+
+	def _set_cached_opt(self, table_name, id, row):
+		self._opt_generations[table_name] += 1
+		self.opt_caches[table_name][id] = OptState(*row)
+
+	def _invalidate_cached_opt(self, table_name, id):
+		self._opt_generations[table_name] += 1
+		self.opt_caches[table_name].discard(id)
+
+	@optional_connection
 	async def delete_all_user_state(self, user_id):
-		await self.bot.pool.execute('DELETE FROM user_opt WHERE id = $1', user_id)
+		await connection().execute(self.queries.delete_all_user_state(), user_id)
+		# not NO_OPT_STATE, in case this is part of a transaction that gets rolled back
+		self._invalidate_cached_opt('user_opt', user_id)
 
 	async def toggle_user_state(self, user_id, guild_id=None) -> bool:
 		"""Toggle whether the user has opted to use the emote auto response.
@@ -623,10 +1722,12 @@ class Database(commands.Cog):
 			default = not guild_state
 		return await self._toggle_state('user_opt', user_id, default)
 
-	def _toggle_state(self, table_name, id, default):
+	async def _toggle_state(self, table_name, id, default):
 		"""toggle the state for a user or guild. If there's no entry already, new state = default."""
 		# TODO consider using one table, with an attribute for whether the state applies to a guild or a user
-		return self.bot.pool.fetchval(self.queries.toggle_state(table_name), id, default)
+		row = await self.bot.pool.fetchrow(self.queries.toggle_state(table_name), id, default)
+		self._set_cached_opt(table_name, id, row)
+		return row['state']
 
 	def toggle_guild_state(self, guild_id):
 		"""Togle whether this guild is opt out.
@@ -636,8 +1737,10 @@ class Database(commands.Cog):
 		"""
 		return self._toggle_state('guild_opt', guild_id, False)
 
-	def _get_state(self, table_name, id):
-		return self.bot.pool.fetchval(self.queries.get_individual_state(table_name), id)
+	async def _get_state(self, table_name, id):
+		if id is None:
+			return None
+		return (await self._get_opt(table_name, id)).state
 
 	def get_user_state(self, user_id):
 		"""return this user's global preference for the emote auto response"""
@@ -647,28 +1750,46 @@ class Database(commands.Cog):
 		"""return whether this guild is opt in"""
 		return self._get_state('guild_opt', guild_id)
 
-	def get_state(self, guild_id, user_id):
+	async def get_state(self, guild_id, user_id):
 		"""return whether emote auto replies should be sent for the given user in the given guild"""
-		# TODO investigate whether this obviates get_guild_state and get_user_state
-		return self.bot.pool.fetchval(self.queries.get_state(), guild_id, user_id)
+		user_opt = await self._get_opt('user_opt', user_id)
+		if user_opt.blacklist_reason is not None:
+			return False
+		if user_opt.state is not None:
+			return user_opt.state
+
+		guild_state = await self.get_guild_state(guild_id)
+		if guild_state is not None:
+			return guild_state
+
+		# not opted in in the guild or the user table, default behavior is ENABLED
+		return True
+
+	def opt_cache_info(self):
+		"""return a mapping of table name to CacheInfo for the user and guild opt caches"""
+		return {table_name: cache.info() for table_name, cache in self.opt_caches.items()}
 
 	## Blacklists
 
-	def get_user_blacklist(self, user_id):
+	async def get_user_blacklist(self, user_id):
 		"""return a reason for the user's blacklist, or None if not blacklisted"""
-		return self.bot.pool.fetchval(self.queries.get_blacklist('user_opt'), user_id)
+		return (await self._get_opt('user_opt', user_id)).blacklist_reason
 
 	async def set_user_blacklist(self, user_id, reason=None):
 		"""make user_id blacklisted
 		setting reason to None removes the user's blacklist
 		"""
-		await self.bot.pool.execute(self.queries.set_blacklist('user_opt'), user_id, reason)
+		await self._set_blacklist('user_opt', user_id, reason)
 
 	async def get_guild_blacklist(self, guild_id):
-		return await self.bot.pool.fetchval(self.queries.get_blacklist('guild_opt'), guild_id)
+		return (await self._get_opt('guild_opt', guild_id)).blacklist_reason
 
 	async def set_guild_blacklist(self, guild_id, reason=None):
-		await self.bot.pool.execute(self.queries.set_blacklist('guild_opt'), guild_id, reason)
+		await self._set_blacklist('guild_opt', guild_id, reason)
+
+	async def _set_blacklist(self, table_name, id, reason):
+		row = await self.bot.pool.fetchrow(self.queries.set_blacklist(table_name), id, reason)
+		self._set_cached_opt(table_name, id, row)
 
 def setup(bot):
 	bot.add_cog(Database(bot))
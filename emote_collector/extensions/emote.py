@@ -17,6 +17,7 @@
 import asyncio
 import collections
 import contextlib
+import datetime
 import getopt
 import io
 import json
@@ -34,7 +35,7 @@ import discord.utils
 from discord.ext import commands
 from jishaku.codeblocks import codeblock_converter
 
-from .db import MessageReplyType
+from .db import MessageReplyType, PageSpecifier
 from .. import BASE_DIR
 from .. import utils
 from ..utils import image as image_utils
@@ -43,9 +44,9 @@ from ..utils import compose
 from ..utils import i18n
 from ..utils import errors
 from ..utils import ObjectProxy
-from ..utils.converter import DatabaseEmoteConverter, Guild, LoggedEmote, UserOrMember
+from ..utils.converter import DatabaseEmoteConverter, Guild, LoggedEmotes, UserOrMember
 from ..utils.i18n import current_locale
-from ..utils.paginator import CannotPaginate, Pages
+from ..utils.paginator import CannotPaginate, Pages, PageSource
 
 logger = logging.getLogger(__name__)
 
@@ -68,6 +69,9 @@ class Emotes(commands.Cog):
 		# keep track of created paginators so that we can remove their reaction buttons on unload
 		self.paginators = weakref.WeakSet()
 
+		# how many messages _may_auto_reply rejected at each stage, and how many it let through
+		self.auto_reply_filter_stats = collections.Counter()
+
 	def cog_unload(self):
 		async def emotes_cog_unload():
 			# aiohttp can't decide if this should be a coroutine...
@@ -145,20 +149,17 @@ class Emotes(commands.Cog):
 	@commands.is_nsfw()
 	async def desync(self, context):
 		"""Gives the difference between emotes in the database and emotes in the backend servers."""
-		backend = {e.id: e for g in self.db.guilds for e in g.emojis}
-		db = {e.id: e async for e in self.db.all_emotes(allow_nsfw=True)}
-		# we have to have IDs in order to compute set difference because Emoji.__eq__ checks the class of other,
-		# so a backend emote is not equal to a cached emote with the same ID.
-		non_backend = set(map(db.get, db.keys() - backend.keys()))
-		non_db = set(map(backend.get, backend.keys() - db.keys()))
+		non_db, non_backend, unseen_guild_ids = await self.db.desynced_emotes()
 		fmt = _(
 			'> Backend server emotes (**{non_db_total}** not in the database)\n'
 			'{non_db_emotes}\n'
 			'> Database emotes (**{non_backend_total}** not in the backend servers)\n'
-			'{non_backend_emotes}')
+			'{non_backend_emotes}\n'
+			'> Servers with emotes in the database that I cannot see: **{unseen_guilds_total}**')
 		await context.send(fmt.format(
 			non_db_total=len(non_db),
 			non_backend_total=len(non_backend),
+			unseen_guilds_total=len(unseen_guild_ids),
 			non_db_emotes=''.join(map(str, non_db)),
 			non_backend_emotes=''.join(map(operator.methodcaller('escaped_name'), non_backend))))
 
@@ -408,18 +409,35 @@ class Emotes(commands.Cog):
 		messages = {}
 		# we could use *emotes: discord.PartialEmoji here but that would require spaces between each emote.
 		# and would fail if any arguments were not valid emotes
+		# these are created concurrently, so only keep the first emote of each name, rather than letting them race.
+		# the rest are reported as already existing, as they would have been if they were created one at a time.
+		matches = []
+		duplicates = []
+		names = set()
 		for match in re.finditer(utils.lexer.t_CUSTOM_EMOTE, ''.join(emotes)):
+			if match['name'].lower() in names:
+				duplicates.append(match)
+			else:
+				names.add(match['name'].lower())
+				matches.append(match)
+
+		async def steal(match):
 			animated, name, id = match.groups()
 			image_url = utils.emote.url(id, animated=animated)
-			async with context.typing():
-				arg = fr'\:{name}:'
+			return await self.add_from_url(name, image_url, context.author.id)
 
-				try:
-					emote = await self.add_from_url(name, image_url, context.author.id)
-				except BaseException as error:
-					messages.setdefault(self._humanize_errors(error), []).append(arg)
-				else:
-					messages.setdefault((0, _('**Successfully created:**')), []).append(str(emote))
+		async with context.typing():
+			# db.create_emote spreads these out over the backend guilds and limits how many are created at once
+			results = await asyncio.gather(*map(steal, matches), return_exceptions=True)
+
+		for match, result in zip(matches, results):
+			if isinstance(result, BaseException):
+				messages.setdefault(self._humanize_errors(result), []).append(fr'\:{match["name"]}:')
+			else:
+				messages.setdefault((0, _('**Successfully created:**')), []).append(str(result))
+
+		for match in duplicates:
+			messages.setdefault((2, _('**Already exists:**')), []).append(fr'\:{match["name"]}:')
 
 		if not messages:
 			return await context.send(_('Error: no existing custom emotes were provided.'))
@@ -600,7 +618,7 @@ class Emotes(commands.Cog):
 		except asyncio.TimeoutError:
 			pass
 		else:
-			await self.db.log_emote_use(emote.id)
+			self.db.log_emote_use(emote.id)
 		finally:
 			# if we don't sleep, it would appear that the bot never un-reacted
 			# i.e. the reaction button would still say "2" even after we remove our reaction
@@ -620,20 +638,13 @@ class Emotes(commands.Cog):
 		"""List all emotes the bot knows about.
 		If a user is provided, the list will only contain emotes created by that user.
 		"""
-		processed = []
-
-		args = []
-		if user is not None:
-			args.append(user.id)
-
-		processed = [
-			emote.with_status(linked=True)
-			async for emote in self.db.all_emotes(*args, allow_nsfw=context.channel)]
-
-		if not processed:
+		author_id = None if user is None else user.id
+		entry_count = await self.db.count_emotes(author_id, allow_nsfw=context.channel)
+		if not entry_count:
 			return await context.send(self.no_emotes_found_error(context, user))
 
-		paginator = Pages(context, entries=processed)
+		paginator = Pages(context, entries=EmoteListPageSource(
+			self.db, entry_count, author_id=author_id, allow_nsfw=context.channel))
 		self.paginators.add(paginator)
 
 		if self.bot.config['website']:
@@ -648,16 +659,13 @@ class Emotes(commands.Cog):
 	async def search(self, context, query):
 		"""Search for emotes whose name contains "query"."""
 
-		processed = [
-			emote.with_status(linked=True)
-			async for emote in self.db.search(query, allow_nsfw=context.channel)]
-
-		if not processed:
+		results = await self.db.search(query, allow_nsfw=context.channel)
+		if not results:
 			if utils.channel_is_nsfw(context.channel):
 				return await context.send(_('No results matched your query.'))
 			return await context.send(_('No results matched your query, or your query only found NSFW emotes.'))
 
-		paginator = Pages(context, entries=processed)
+		paginator = Pages(context, entries=EmoteSearchPageSource(results))
 		self.paginators.add(paginator)
 		await self.warn_if_no_external_emojis_permission(context)
 		await paginator.begin()
@@ -744,16 +752,17 @@ class Emotes(commands.Cog):
 			return _('That person has not created any emotes yet, or all their emotes are NSFW.')
 
 	@commands.command(enabled=False)
-	async def recover(self, context, emote: LoggedEmote):
-		"""Recovers a decayed or removed emote from a log channel.
+	async def recover(self, context, emotes: LoggedEmotes):
+		"""Recovers decayed or removed emotes from a log channel.
 
 		message is the channel and message ID of the log message. To get it you can use developer mode.
 		Either pass it as channel_id-message_id (shift click on "Copy ID"), or pass a jump link.
+		Every emote listed in that message is recovered.
 
-		The emote will be owned by you, so that you can edit it.
+		The emotes will be owned by you, so that you can edit them.
 		"""
-		message = await self.add_safe(emote.name, str(emote.url), context.author.id)
-		await context.send(message)
+		messages = [await self.add_safe(emote.name, str(emote.url), context.author.id) for emote in emotes]
+		await context.send('\n'.join(messages))
 
 	@commands.command()
 	async def toggle(self, context):
@@ -863,9 +872,16 @@ class Emotes(commands.Cog):
 		"""Reply to messages containing :name: or ;name; with the corresponding emotes.
 		This is like half the functionality of the bot
 		"""
-		await self.bot.set_locale(message)
+		if not self._may_auto_reply(message.content):
+			return
 
-		if not await self._should_auto_reply(message):
+		if not self.bot.should_reply(message):
+			return
+
+		pipeline = self.bot.pipeline(message)
+		await pipeline.set_locale()
+
+		if not await self._should_auto_reply(pipeline):
 			return
 
 		reply, has_emotes = await self.extract_emotes(message, log_usage=True)
@@ -879,21 +895,43 @@ class Emotes(commands.Cog):
 
 		await self.db.add_reply_message(message.id, MessageReplyType.auto, reply.id)
 
-	async def _should_auto_reply(self, message: discord.Message):
-		"""return whether the bot should send an emote auto response to message"""
+	def _may_auto_reply(self, content):
+		"""return whether content could possibly get an emote auto response.
+		This runs before anything else in on_message, so it must be cheap and must never await.
 
-		if not self.bot.should_reply(message):
+		A message is rejected if:
+			1) it has no ":" or ";" in it, or
+			2) the emote cache is warm, and none of the :name: or ;name; in it are the names of emotes.
+		"""
+		if ':' not in content and ';' not in content:
+			self.auto_reply_filter_stats['no_delimiter'] += 1
 			return False
 
-		context = await self.bot.get_context(message)
-		if context.valid:
-			# user invoked a command, rather than the emote auto response
-			# so don't respond a second time
+		cache = self.db.emote_cache
+		if cache.ready.is_set() and not any(
+			self._emote_name(toke1) in cache
+			for toke1 in utils.lexer.tokenize(content)
+			if self._is_emote(toke1)
+		):
+			self.auto_reply_filter_stats['no_known_emote'] += 1
 			return False
 
+		self.auto_reply_filter_stats['passed'] += 1
+		return True
+
+	async def _should_auto_reply(self, pipeline: utils.pipeline.MessagePipeline):
+		"""return whether the bot should send an emote auto response to the pipeline's message"""
+		message = pipeline.message
+
 		if not self.bot.has_permissions(message, external_emojis=True):
 			return False
 
+		context = await pipeline.context()
+		if context.valid:
+			# user invoked a command, rather than the emote auto response
+			# so don't respond a second time
+			return False
+
 		if message.guild:
 			guild = message.guild.id
 		else:
@@ -927,7 +965,7 @@ class Emotes(commands.Cog):
 				await self.on_message(message)
 			return
 
-		await self.bot.set_locale(message)
+		await self.bot.pipeline(message).set_locale()
 
 		handlers = {
 			MessageReplyType.auto: self._handle_extracted_edit,
@@ -947,7 +985,8 @@ class Emotes(commands.Cog):
 
 	async def _handle_quoted_edit(self, message, reply_message_id):
 		"""handle the case when the user edits an ec/quote invocation"""
-		context = await self.bot.get_context(message)
+		# nothing else consumes the view of an edited message's context
+		context = await self.bot.pipeline(message).context()
 		content = context.view.read_rest()
 		if not context.command or not context.command is self.quote or not content:
 			return await self.delete_reply(message.channel.id, message.id)
@@ -963,15 +1002,20 @@ class Emotes(commands.Cog):
 		message: discord.Message,
 		content: str = None,
 		*,
-		callback,
+		callback=None,
+		render=None,
 		log_usage=False,
 	):
-		"""Extract emotes according to predicate.
+		"""Extract emotes according to predicate. Exactly one of callback or render must be provided.
 		Callback is a coroutine function taking three arguments: token, out: StringIO, and emotes_used: set
 		For each token, callback will be called with these arguments.
 		out is the StringIO that holds the extracted string to return, and emotes_used is a set
 		containing the IDs of all emotes that were used, for logging purposes.
 
+		Render is a regular function which takes a fourth argument, emotes: a dict of lowercased names to emotes.
+		If it's provided, the whole message is tokenized first, and all the emote names in it are looked up at once,
+		so that a message with many emotes only costs one query.
+
 		Returns extracted_message: str, has_emotes: bool.
 		"""
 
@@ -981,33 +1025,36 @@ class Emotes(commands.Cog):
 		if content is None:
 			content = message.content
 
-		# we make a new one each time otherwise two tasks might use the same lexer at the same time
-		lexer = utils.lexer.new()
-
-		lexer.input(content)
-		for toke1 in iter(lexer.token, None):
-			await callback(toke1, out, emotes_used)
+		if render is None:
+			for toke1 in utils.lexer.tokenize(content):
+				await callback(toke1, out, emotes_used)
+		else:
+			tokens = list(utils.lexer.tokenize(content))
+			emotes = await self.db.get_emotes(self._emote_name(toke1) for toke1 in tokens if self._is_emote(toke1))
+			for toke1 in tokens:
+				render(toke1, out, emotes_used, emotes)
 
 		result = out.getvalue() if emotes_used else content
 
 		if log_usage:
 			for emote in emotes_used:
-				await self.db.log_emote_use(emote)
+				self.db.log_emote_use(emote)
 
 		return utils.clean_content(self.bot, message, result), bool(emotes_used)
 
 	async def extract_emotes(self, message: discord.Message, content: str = None, *, log_usage=False):
 		"""Parse all emotes (:name: or ;name;) from a message"""
 
-		async def callback(toke1, out, emotes_used):
-			if toke1.type == 'TEXT' and toke1.value == '\n':
-				return out.write(toke1.value)
+		def render(toke1, out, emotes_used, emotes):
+			if toke1.type == 'TEXT':
+				# keep the line breaks in the message, but nothing else
+				return out.write('\n' * toke1.value.count('\n'))
 			if not self._is_emote(toke1):
 				return
 
 			try:
-				emote = await self.db.get_emote(toke1.value.strip(':;'))
-			except errors.EmoteNotFoundError:
+				emote = emotes[self._emote_name(toke1)]
+			except KeyError:
 				return
 
 			if not emote.is_nsfw or getattr(message.channel, 'nsfw', True):
@@ -1017,7 +1064,7 @@ class Emotes(commands.Cog):
 		extracted, has_emotes = await self._extract_emotes(
 			message,
 			content,
-			callback=callback,
+			render=render,
 			log_usage=log_usage)
 
 		return extracted.strip(), has_emotes
@@ -1025,27 +1072,36 @@ class Emotes(commands.Cog):
 	async def quote_emotes(self, message: discord.Message, content: str = None, *, log_usage=False):
 		"""Parse all emotes (:name: or ;name;) from a message, preserving non-emote text"""
 
-		async def callback(toke1, out, emotes_used):
+		def render(toke1, out, emotes_used, emotes):
 			if not self._is_emote(toke1):
 				return out.write(toke1.value)
 
 			try:
-				emote = await self.db.get_emote(toke1.value.strip(':;'))
-			except errors.EmoteNotFoundError:
+				emote = emotes[self._emote_name(toke1)]
+			except KeyError:
 				return out.write('\\'+toke1.value)
 
 			if not emote.is_nsfw or getattr(message.channel, 'nsfw', True):
 				out.write(str(emote))
 				emotes_used.add(emote.id)
 
-		return await self._extract_emotes(message, content, callback=callback, log_usage=log_usage)
+		return await self._extract_emotes(message, content, render=render, log_usage=log_usage)
 
 	@staticmethod
 	def _is_emote(toke1):
 		return toke1.type == 'EMOTE' and toke1.value.strip(':') not in utils.emote.emoji_shortcodes
 
+	@staticmethod
+	def _emote_name(toke1):
+		"""return the lowercased name of an EMOTE token, as used for keys in the result of Database.get_emotes"""
+		return toke1.value.strip(':;').lower()
+
 	async def delete_reply(self, channel_id, message_id):
 		"""Delete our reply to a message containing emotes."""
+		if not self.db.may_have_reply(message_id):
+			# most deleted messages never got a reply, so save two queries
+			return
+
 		reply_message = await self.db.delete_reply_by_invoking_message(message_id)
 		if not reply_message:
 			# if there's no reply, it's possible that our reply itself was deleted directly
@@ -1062,9 +1118,95 @@ class Emotes(commands.Cog):
 
 	@commands.Cog.listener()
 	async def on_raw_bulk_message_delete(self, payload):
-		# TODO use bot.delete_messages
-		for message_id in payload.message_ids:
-			await self.delete_reply(payload.channel_id, message_id)
+		reply_messages = await self.db.delete_replies(payload.message_ids)
+		if reply_messages:
+			await self.delete_own_messages(payload.channel_id, reply_messages)
+
+	# discord refuses to bulk delete messages older than 2 weeks. leave some leeway for clock skew.
+	BULK_DELETE_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=5)
+	BULK_DELETE_MAX_COUNT = 100
+	MAX_CONCURRENT_DELETES = 5
+
+	async def delete_own_messages(self, channel_id, message_ids):
+		"""Delete many messages sent by the bot in one channel, in bulk where possible."""
+		channel = self.bot.get_channel(channel_id)
+		guild = getattr(channel, 'guild', None)
+		# unlike deleting our own messages one by one, bulk deletion requires Manage Messages
+		can_bulk_delete = guild is not None and channel.permissions_for(guild.me).manage_messages
+		cutoff = discord.utils.time_snowflake(datetime.datetime.utcnow() - self.BULK_DELETE_MAX_AGE)
+
+		bulk, single = [], []
+		for message_id in message_ids:
+			(bulk if can_bulk_delete and message_id > cutoff else single).append(message_id)
+
+		for i in range(0, len(bulk), self.BULK_DELETE_MAX_COUNT):
+			chunk = bulk[i:i+self.BULK_DELETE_MAX_COUNT]
+			if len(chunk) == 1:
+				# the bulk delete endpoint requires at least two messages
+				single.extend(chunk)
+				continue
+
+			try:
+				await self.bot.http.delete_messages(channel_id, chunk)
+			except discord.HTTPException:
+				single.extend(chunk)
+
+		semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_DELETES)
+		async def delete(message_id):
+			async with semaphore:
+				with contextlib.suppress(discord.HTTPException):
+					await self.bot.http.delete_message(channel_id, message_id)
+
+		await asyncio.gather(*map(delete, single))
+
+class EmoteListPageSource(PageSource):
+	"""Emotes sorted by name, fetched a page at a time using keyset pagination from any neighbouring cached page."""
+
+	def __init__(self, db, entry_count, *, author_id=None, allow_nsfw=False):
+		super().__init__(entry_count)
+		self.db = db
+		self.author_id = author_id
+		self.allow_nsfw = allow_nsfw
+
+	async def fetch_page(self, page):
+		limit, offset = self.per_page, 0
+		previous_page, next_page = self.cached_page(page - 1), self.cached_page(page + 1)
+
+		if previous_page:
+			specifier = PageSpecifier.after(previous_page[-1].name)
+		elif next_page:
+			specifier = PageSpecifier.before(next_page[0].name)
+		elif page == self.page_count:
+			specifier = PageSpecifier.last()
+			# keep the last page lined up with the others
+			limit = self.entry_count - (page - 1) * self.per_page
+		else:
+			# a jump to a page with no cached neighbours
+			specifier = PageSpecifier.first()
+			offset = (page - 1) * self.per_page
+
+		return await self.db.all_emotes_keyset(
+			self.author_id, allow_nsfw=self.allow_nsfw, page=specifier, limit=limit, offset=offset)
+
+	async def count_entries(self):
+		return await self.db.count_emotes(self.author_id, allow_nsfw=self.allow_nsfw)
+
+	def format_entry(self, emote):
+		return emote.with_status(linked=True)
+
+class EmoteSearchPageSource(PageSource):
+	"""Search results, which are only formatted a page at a time since there may be thousands of them."""
+
+	def __init__(self, results):
+		super().__init__(len(results))
+		self.results = results
+
+	async def fetch_page(self, page):
+		start = (page - 1) * self.per_page
+		return self.results[start:start+self.per_page]
+
+	def format_entry(self, emote):
+		return emote.with_status(linked=True)
 
 def setup(bot):
 	bot.add_cog(Emotes(bot))
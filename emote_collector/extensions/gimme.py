@@ -30,7 +30,6 @@ logger = logging.getLogger(__name__)
 class Gimme(commands.Cog):
 	def __init__(self, bot):
 		self.bot = bot
-		self.guild_ids = ObjectProxy(lambda: bot.cogs['Database'].guild_ids)
 		self.guilds = ObjectProxy(lambda: bot.cogs['Database'].guilds)
 		self.task = self.bot.loop.create_task(self.delete_backend_guild_messages())
 
@@ -62,7 +61,9 @@ class Gimme(commands.Cog):
 
 	@commands.Cog.listener()
 	async def on_message(self, message):
-		if getattr(message.guild, 'id', None) in self.guild_ids:
+		db = self.bot.get_cog('Database')
+		# without the Database cog, no guild is known to be a backend guild
+		if db is not None and getattr(message.guild, 'id', None) in db.guild_ids:
 			await asyncio.sleep(5)
 			with contextlib.suppress(discord.HTTPException):
 				await message.delete()
@@ -17,6 +17,7 @@
 import typing
 
 import discord
+from bot_bin.sql import connection, optional_connection
 from discord.ext import commands
 
 from .. import utils
@@ -51,6 +52,12 @@ class Locales(commands.Cog):
 	def __init__(self, bot):
 		self.bot = bot
 		self.queries = self.bot.queries('locale.sql')
+		# (user, channel, guild) → resolved locale
+		self.locale_cache = utils.cache.LRUCache(10_000, ttl=600)
+		self.bot.invalidation_bus.add_handler(self, 'locales', self._on_locale_changed, self._clear_locale_cache)
+
+	def cog_unload(self):
+		self.bot.invalidation_bus.remove_handlers(self)
 
 	@commands.command(aliases=(
 		'languages',  # en_US
@@ -153,7 +160,30 @@ class Locales(commands.Cog):
 		return await self.user_channel_or_guild_locale(user, channel, guild) or i18n.default_locale
 
 	async def user_channel_or_guild_locale(self, user, channel, guild=None):
-		return await self.bot.pool.fetchval(self.queries.locale(), user, channel, guild)
+		key = user, channel, guild
+		try:
+			return self.locale_cache[key]
+		except KeyError:
+			pass
+
+		locale = self.locale_cache[key] = await self.bot.pool.fetchval(self.queries.locale(), user, channel, guild)
+		return locale
+
+	def _invalidate_locales(self, predicate):
+		"""forget the cached locale for every (user, channel, guild) key which satisfies predicate"""
+		self.locale_cache.discard_if(lambda key: predicate(*key))
+
+	def _on_locale_changed(self, guild, channel, user):
+		"""invalidate the cached locales affected by a change to the locales row with the given key"""
+		if user is not None:
+			self._invalidate_locales(lambda user_id, channel_id, guild_id: user_id == user)
+		elif channel is not None:
+			self._invalidate_locales(lambda user_id, channel_id, guild_id: channel_id == channel)
+		else:
+			self._invalidate_locales(lambda user_id, channel_id, guild_id: guild_id == guild)
+
+	async def _clear_locale_cache(self):
+		self.locale_cache.clear()
 
 	async def channel_or_guild_locale(self, channel):
 		return await self.bot.pool.fetchval(self.queries.channel_or_guild_locale(), channel.guild.id, channel.id)
@@ -166,15 +196,20 @@ class Locales(commands.Cog):
 			# TODO see if this can be done in one statement using upsert
 			await conn.execute(self.queries.delete_guild_locale(), guild)
 			await conn.execute(self.queries.set_guild_locale(), guild, locale)
+		self._invalidate_locales(lambda user_id, channel_id, guild_id: guild_id == guild)
 
 	async def set_channel_locale(self, guild, channel, locale):
 		await self.bot.pool.execute(self.queries.update_channel_locale(), guild, channel, locale)
+		self._invalidate_locales(lambda user_id, channel_id, guild_id: channel_id == channel)
 
 	async def set_user_locale(self, user, locale):
 		await self.bot.pool.execute(self.queries.update_user_locale(), user, locale)
+		self._invalidate_locales(lambda user_id, channel_id, guild_id: user_id == user)
 
+	@optional_connection
 	async def delete_user_account(self, user_id):
-		await self.bot.pool.execute(self.queries.delete_user_locale(), user_id)
+		await connection().execute(self.queries.delete_user_locale(), user_id)
+		self._invalidate_locales(lambda user, channel, guild: user == user_id)
 
 def setup(bot):
 	bot.add_cog(Locales(bot))
@@ -136,6 +136,27 @@ class Logger(commands.Cog):
 
 		return await self._log(event=event, nsfw=emote.is_nsfw, embed=e)
 
+	# keeps each embed description well under the length limit
+	BATCH_LOG_MAX_EMOTES = 10
+
+	async def log_emote_actions(self, *, event, emotes, title=None):
+		"""log the same action on many emotes at once, using one message per batch of emotes rather than per emote"""
+		messages = []
+		for nsfw in False, True:
+			matching = [emote for emote in emotes if emote.is_nsfw == nsfw]
+			for i in range(0, len(matching), self.BATCH_LOG_MAX_EMOTES):
+				batch = matching[i:i+self.BATCH_LOG_MAX_EMOTES]
+				e = discord.Embed()
+				e.title = title or event.title()
+				e.colour = getattr(LogColor, event)
+				e.description = '\n'.join(
+					f'[{emote.name}]({emote.url}) by {utils.format_user(self.bot, emote.author, mention=True)}'
+					for emote in batch)
+				e.set_thumbnail(url=batch[0].url)
+				e.set_footer(text=f'{len(batch)} emotes' if len(batch) != 1 else '1 emote')
+				messages.extend(await self._log(event=event, nsfw=nsfw, embed=e))
+		return messages
+
 	@commands.Cog.listener()
 	async def on_emote_add(self, emote):
 		return await self.log_emote_action(event='add', emote=emote)
@@ -145,8 +166,8 @@ class Logger(commands.Cog):
 		return await self.log_emote_action(event='remove', emote=emote)
 
 	@commands.Cog.listener()
-	async def on_emote_decay(self, emote):
-		return await self.log_emote_action(event='decay', emote=emote)
+	async def on_emotes_decay(self, emotes):
+		return await self.log_emote_actions(event='decay', emotes=emotes)
 
 	@commands.Cog.listener()
 	async def on_emote_force_remove(self, emote, responsible_moderator: discord.User):
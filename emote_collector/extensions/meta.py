@@ -15,15 +15,18 @@
 # along with Emote Collector. If not, see <https://www.gnu.org/licenses/>.
 
 import asyncio
+import contextlib
 import inspect
 import itertools
 import os
 import pkg_resources
+import time
 
 import discord
 import humanize
 import pygit2
 import psutil
+from bot_bin.sql import connection
 from discord.ext import commands
 
 from .. import utils
@@ -238,6 +241,9 @@ class Meta(commands.Cog):
 	def cog_unload(self):
 		self.bot.help_command = self.old_help
 
+	# seconds between edits of the delete-my-account status message
+	PROGRESS_REPORT_INTERVAL = 2
+
 	@commands.command(name='delete-my-account')
 	async def delete_my_account(self, context):
 		"""Permanently deletes all information I have on you.
@@ -262,10 +268,25 @@ class Meta(commands.Cog):
 			return
 
 		status_message = await context.send(_('Deleting your account…'))
+		last_report = 0
+
+		async def report_progress(deleted, total):
+			nonlocal last_report
+			# editing is rate limited too, so don't report every emote
+			if deleted < total and time.monotonic() - last_report < self.PROGRESS_REPORT_INTERVAL:
+				return
+			last_report = time.monotonic()
+			with contextlib.suppress(discord.HTTPException):
+				await status_message.edit(content=_(
+					'Deleting your account… ({deleted}/{total} emotes deleted)').format(**locals()))
 
 		async with context.typing():
-			for cog_name in 'Database', 'Locales', 'API', 'BingoDatabase':
-				await self.bot.cogs[cog_name].delete_user_account(context.author.id)
+			# deleting the emotes from the backend guilds is the slow part, so do it before opening the transaction
+			await self.bot.cogs['Database'].delete_all_user_emotes(context.author.id, progress=report_progress)
+			async with self.bot.pool.acquire() as conn, conn.transaction():
+				connection.set(conn)
+				for cog_name in 'Database', 'Locales', 'API', 'BingoDatabase':
+					await self.bot.cogs[cog_name].delete_user_account(context.author.id)
 
 		await status_message.delete()
 		await context.send(_("{context.author.mention} I've deleted your account successfully.").format(**locals()))
@@ -0,0 +1,176 @@
+import asyncio
+import datetime
+import logging
+import time
+
+import discord
+
+from emote_collector.extensions.db import DatabaseEmote, EmojiRateLimitHandler, EmoteCache, RecentReplies, SlotAllocator
+from emote_collector.utils import errors
+
+def allocate_all(slots, animated=False):
+	guild_ids = []
+	while True:
+		try:
+			guild_ids.append(slots.allocate(animated))
+		except errors.NoMoreSlotsError:
+			return guild_ids
+
+def test_slot_allocator_round_robin():
+	slots = SlotAllocator()
+	slots.add_guild(1, 2)
+	slots.add_guild(2, 2)
+	assert len(slots) == 2
+	assert slots.capacity() == (4, 4, 8)
+
+	# each guild gets used in turn
+	assert allocate_all(slots) == [1, 2, 1, 2]
+	# static and animated slots are counted separately
+	assert allocate_all(slots, animated=True) == [1, 2, 1, 2]
+
+def test_slot_allocator_release():
+	slots = SlotAllocator()
+	slots.add_guild(1, 1, static_usage=1)
+	assert allocate_all(slots) == []
+
+	slots.release(1, False)
+	assert slots.free_slots(1, False) == 1
+	assert allocate_all(slots) == [1]
+
+	# releasing more than was used, or in an unknown guild, does nothing
+	slots.release(1, True)
+	slots.release(3, False)
+	assert slots.free_slots(1, True) == 1
+	assert allocate_all(slots, animated=True) == [1]
+
+def test_slot_allocator_defer():
+	slots = SlotAllocator()
+	slots.add_guild(1, 2)
+	slots.add_guild(2, 2)
+	slots.defer(1, time.time() + 3600)
+	# deferring guild 1 leaves its old heap entry behind, which must be skipped
+	slots.defer(1, time.time() + 7200)
+	# deferring to an earlier time does nothing
+	slots.defer(1, 0)
+
+	# guild 1 is only used once every other guild is full, and then only as often as it has slots
+	assert allocate_all(slots) == [2, 2, 1, 1]
+
+def test_slot_allocator_ready_at():
+	slots = SlotAllocator()
+	slots.add_guild(1, 2, ready_at=time.time() + 3600)
+	slots.add_guild(2, 2, ready_at=1.0)
+	slots.add_guild(3, 2)
+	assert allocate_all(slots)[:2] == [3, 2]
+	assert slots.ready_at(1) > time.time()
+
+def test_slot_allocator_invalidation():
+	slots = SlotAllocator()
+	slots.add_guild(1, 1)
+	slots.add_guild(2, 1)
+	slots.add_guild(3, 2)
+
+	# an emote created elsewhere fills guild 1, whose heap entry is now stale
+	slots.use(1, False)
+	slots.remove_guild(2)
+	assert len(slots) == 2
+	assert allocate_all(slots) == [3, 3]
+
+	slots.set_limit(1, 2)
+	assert allocate_all(slots) == [1]
+
+def snowflake(minutes_ago):
+	return discord.utils.time_snowflake(datetime.datetime.utcnow() - datetime.timedelta(minutes=minutes_ago))
+
+def test_recent_replies():
+	replies = RecentReplies(datetime.timedelta(hours=1))
+	invoking, reply = snowflake(0), snowflake(0) + 1
+	replies.add(invoking, 'AUTO', reply)
+
+	assert invoking in replies and reply in replies
+	assert replies.get(invoking) == ('AUTO', reply)
+	assert len(replies) == 1
+
+	assert replies.pop_by_reply(reply)
+	assert not replies.pop_by_reply(reply)
+	assert invoking not in replies and reply not in replies
+
+	replies.add(invoking, 'AUTO', reply)
+	assert replies.pop_by_invoking(invoking) == reply
+	assert replies.pop_by_invoking(invoking) is None
+	assert len(replies) == 0
+
+def test_recent_replies_window():
+	replies = RecentReplies(datetime.timedelta(hours=1))
+	# nothing sent before it was created is known
+	assert not replies.covers(snowflake(1))
+	assert replies.covers(snowflake(-1))
+
+	old_invoking = snowflake(120)
+	replies.add(old_invoking, 'AUTO', old_invoking + 1)
+	new_invoking = snowflake(-1)
+	replies.add(new_invoking, 'AUTO', new_invoking + 1)
+
+	replies.prune()
+	assert old_invoking not in replies and old_invoking + 1 not in replies
+	assert new_invoking in replies
+
+def emote(id, name, *, animated=False, nsfw='SFW', guild=1):
+	return DatabaseEmote(dict(
+		id=id, name=name, author=0, animated=animated, description=None, created=None, modified=None,
+		preserve=False, guild=guild, nsfw=nsfw))
+
+def test_emote_cache():
+	cache = EmoteCache()
+	cache.update(emote(1, 'Kappa'))
+	cache.update(emote(2, 'keepo', animated=True, nsfw='SELF_NSFW', guild=2))
+	assert cache.get('kappa').id == 1
+	assert cache.counts() == (1, 1, 1, 2)
+
+	# renaming frees the old name
+	cache.update(emote(1, 'Kappa2'))
+	assert 'kappa' not in cache and 'kappa2' in cache
+	assert [emote.id for emote in cache.search('kappa')] == [1]
+
+	cache.discard_guild(2)
+	assert cache.get_by_id(2) is None
+	assert cache.counts() == (1, 0, 0, 1)
+
+def test_emote_cache_load_keeps_concurrent_changes():
+	cache = EmoteCache()
+
+	async def load():
+		fetched = asyncio.Event()
+		done = asyncio.Event()
+
+		async def fetch():
+			fetched.set()
+			await done.wait()
+			# a snapshot taken before the changes below
+			return [emote(1, 'foo'), emote(2, 'bar')]
+
+		task = asyncio.create_task(cache.load(fetch()))
+		await fetched.wait()
+		cache.update(emote(3, 'baz'))
+		cache.discard(2)
+		done.set()
+		await task
+
+	asyncio.run(load())
+	assert cache.ready.is_set()
+	assert sorted(emote.id for emote in cache._emotes.values()) == [1, 3]
+	assert cache.counts().total == 2
+
+def test_emoji_rate_limit_handler():
+	created, deleted = [], []
+	handler = EmojiRateLimitHandler(lambda *args: created.append(args), lambda *args: deleted.append(args))
+
+	def rate_limited(bucket):
+		message = 'We are being rate limited. Retrying in %.2f seconds. Handled under the bucket "%s"'
+		handler.emit(logging.LogRecord('discord.http', logging.WARNING, '', 0, message, (1.5, bucket), None))
+
+	rate_limited('None:123:/guilds/{guild_id}/emojis')
+	rate_limited('None:456:/guilds/{guild_id}/emojis/{emoji_id}')
+	rate_limited('789:None:/channels/{channel_id}/messages')
+	assert created == [(123, 1.5)]
+	assert deleted == [(456, 1.5)]
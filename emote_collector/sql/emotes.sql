@@ -31,12 +31,9 @@ WHERE id = $1
 
 --- INFORMATIONAL
 
--- :macro free_guild(animated)
-SELECT id
+-- :macro guild_usage()
+SELECT id, static_usage, animated_usage, last_creation
 FROM guilds
-WHERE {{ 'animated' if animated else 'static' }}_usage < 50
-ORDER BY last_creation
-LIMIT 1
 -- :endmacro
 
 -- :macro count()
@@ -55,12 +52,52 @@ FROM emotes
 WHERE LOWER(name) = LOWER($1)
 -- :endmacro
 
+-- :macro get_emotes()
+-- params: lowercased names
+SELECT *
+FROM emotes
+WHERE LOWER(name) = ANY ($1)
+-- :endmacro
+
+-- :macro get_emotes_by_id()
+-- params: ids
+SELECT *
+FROM emotes
+WHERE id = ANY ($1)
+-- :endmacro
+
+-- :macro all_emotes()
+SELECT *
+FROM emotes
+-- :endmacro
+
+-- :macro all_user_emotes()
+-- params: author_id
+SELECT *
+FROM emotes
+WHERE author = $1
+-- :endmacro
+
+-- :macro guild_emotes()
+-- params: guild_id
+SELECT *
+FROM emotes
+WHERE guild = $1
+-- :endmacro
+
+-- :macro guild_emote_checksums()
+-- must match Database.emote_id_checksum
+SELECT guild, md5(string_agg(id::TEXT, ',' ORDER BY id))
+FROM emotes
+GROUP BY guild
+-- :endmacro
+
 -- :macro get_emote_usage()
 -- params: id, cutoff_time
-SELECT COUNT(*)
-FROM emote_usage_history
+SELECT COALESCE(SUM(uses), 0)
+FROM emote_usage_rollup
 WHERE id = $1
-  AND time > $2
+  AND day >= ($2::TIMESTAMP WITH TIME ZONE AT TIME ZONE 'UTC')::DATE
 -- :endmacro
 
 -- :macro get_reply_message()
@@ -72,7 +109,7 @@ WHERE invoking_message = $1
 
 --- ITERATORS
 
--- :macro all_emotes_keyset(sort_order, filter_author=False, end=False)
+-- :macro all_emotes_keyset(sort_order, filter_author=False, end=False, offset=False)
 SELECT *
 FROM emotes
 WHERE nsfw = ANY ($1)
@@ -86,20 +123,33 @@ WHERE nsfw = ANY ($1)
 	-- :set argc = argc + 1
 -- :endif
 ORDER BY LOWER(name) {{ sort_order }} LIMIT ${{ argc }}
+-- :if offset
+OFFSET ${{ argc + 1 }}
+-- :endif
+-- :endmacro
+
+-- :macro count_emotes(filter_author=False)
+-- params: allowed_nsfw_types, author_id (optional)
+SELECT COUNT(*)
+FROM emotes
+WHERE
+	nsfw = ANY ($1)
+	{% if filter_author %}AND author = $2{% endif %}
 -- :endmacro
 
--- :set emote_usage_history_prelude
-SELECT e.*, COUNT(euh.id) AS usage
+-- usage is counted in whole days (UTC), including all of the day that the cutoff time falls on
+-- :set emote_usage_prelude
+SELECT e.*, COALESCE(SUM(eur.uses), 0) AS usage
 FROM
 	emotes AS e
-	LEFT JOIN emote_usage_history AS euh
-		ON euh.id = e.id
-		AND euh.time > $1
+	LEFT JOIN emote_usage_rollup AS eur
+		ON eur.id = e.id
+		AND eur.day >= ($1::TIMESTAMP WITH TIME ZONE AT TIME ZONE 'UTC')::DATE
 -- :endset
 
 -- :macro popular_emotes(filter_author=False)
 -- params: cutoff_time, limit, allowed_nsfw_types, author_id (optional)
-{{ emote_usage_history_prelude }}
+{{ emote_usage_prelude }}
 WHERE
 	nsfw = ANY ($3)
 	{% if filter_author %}AND author = $4{% endif %}
@@ -120,12 +170,12 @@ LIMIT 100
 
 -- :macro decayable_emotes()
 -- params: cutoff_time, usage_threshold
-{{ emote_usage_history_prelude }}
+{{ emote_usage_prelude }}
 WHERE
 	created < $1
 	AND NOT preserve
 GROUP BY e.id
-HAVING COUNT(euh.id) < $2
+HAVING COALESCE(SUM(eur.uses), 0) < $2
 -- :endmacro
 
 --- ACTIONS
@@ -137,10 +187,19 @@ VALUES ($1, $2, $3, $4, $5)
 RETURNING *
 -- :endmacro
 
--- :macro remove_emote()
--- params: id
+-- :macro remove_emotes()
+-- params: ids
 DELETE FROM emotes
-WHERE id = $1
+WHERE id = ANY ($1)
+RETURNING id, guild, animated
+-- :endmacro
+
+-- :macro sync_emote_name()
+-- params: id, name
+UPDATE emotes
+SET name = $2
+WHERE id = $1 AND name != $2
+RETURNING *
 -- :endmacro
 
 -- :macro rename_emote()
@@ -156,6 +215,7 @@ RETURNING *
 UPDATE EMOTES
 SET created = $2
 WHERE LOWER(name) = LOWER($1)
+RETURNING *
 -- :endmacro
 
 -- :macro set_emote_description()
@@ -182,10 +242,72 @@ WHERE id = $1
 RETURNING *
 -- :endmacro
 
--- :macro log_emote_use()
--- params: id
-INSERT INTO emote_usage_history (id)
-VALUES ($1)
+-- :macro increment_emote_usage_rollup()
+-- params: ids, days, uses
+INSERT INTO emote_usage_rollup (id, day, uses)
+SELECT * FROM UNNEST($1::BIGINT[], $2::DATE[], $3::INTEGER[])
+ON CONFLICT (id, day) DO UPDATE
+	SET uses = emote_usage_rollup.uses + EXCLUDED.uses
+-- :endmacro
+
+-- :macro emote_usage_history_partitions()
+SELECT c.relname
+FROM
+	pg_inherits AS i
+	INNER JOIN pg_class AS c
+		ON c.oid = i.inhrelid
+WHERE i.inhparent = 'emote_usage_history'::REGCLASS
+-- :endmacro
+
+-- :macro create_emote_usage_history_partition(name, start, end)
+CREATE TABLE IF NOT EXISTS {{ name }}
+PARTITION OF emote_usage_history
+FOR VALUES FROM ('{{ start }} 00:00+00') TO ('{{ end }} 00:00+00')
+-- :endmacro
+
+-- blocks writes to the default partition, but not reads
+-- :macro lock_default_emote_usage_history()
+LOCK TABLE emote_usage_history_default IN EXCLUSIVE MODE
+-- :endmacro
+
+-- :macro default_emote_usage_history_has_rows()
+-- params: start, end
+SELECT EXISTS (
+	SELECT 1
+	FROM emote_usage_history_default
+	WHERE time >= $1 AND time < $2)
+-- :endmacro
+
+-- :macro create_detached_emote_usage_history_partition(name)
+CREATE TABLE {{ name }} (LIKE emote_usage_history INCLUDING DEFAULTS)
+-- :endmacro
+
+-- :macro move_default_emote_usage_history(name)
+-- params: start, end
+WITH moved AS (
+	DELETE FROM emote_usage_history_default
+	WHERE time >= $1 AND time < $2
+	RETURNING id, time)
+INSERT INTO {{ name }} (id, time)
+SELECT id, time
+FROM moved
+-- :endmacro
+
+-- :macro attach_emote_usage_history_partition(name, start, end)
+ALTER TABLE emote_usage_history
+ATTACH PARTITION {{ name }}
+FOR VALUES FROM ('{{ start }} 00:00+00') TO ('{{ end }} 00:00+00')
+-- :endmacro
+
+-- :macro drop_emote_usage_history_partition(name)
+DROP TABLE IF EXISTS {{ name }}
+-- :endmacro
+
+-- :macro existing_emote_ids()
+-- params: ids
+SELECT id
+FROM emotes
+WHERE id = ANY ($1)
 -- :endmacro
 
 -- :macro add_reply_message()
@@ -207,6 +329,29 @@ DELETE FROM replies
 WHERE reply_message = $1
 -- :endmacro
 
+-- :macro delete_replies()
+-- params: message_ids
+DELETE FROM replies
+WHERE invoking_message = ANY ($1) OR reply_message = ANY ($1)
+RETURNING invoking_message, reply_message
+-- :endmacro
+
+-- :macro count_replies()
+SELECT COUNT(*)
+FROM replies
+-- :endmacro
+
+-- :macro all_reply_message_ids()
+SELECT invoking_message, reply_message
+FROM replies
+-- :endmacro
+
+-- :macro prune_replies()
+-- params: cutoff_message_id
+DELETE FROM replies
+WHERE invoking_message < $1
+-- :endmacro
+
 --- USER / GUILD OPTIONS
 
 -- :macro delete_all_user_state()
@@ -221,34 +366,17 @@ INSERT INTO {{ table }} (id, state)
 VALUES ($1, $2)
 ON CONFLICT (id) DO UPDATE
 	SET state = NOT {{ table }}.state
-RETURNING state
+RETURNING state, blacklist_reason
 -- :endmacro
 
--- :macro get_individual_state(table)
+-- :macro get_opt(table)
 -- params: id
-SELECT state
+SELECT state, blacklist_reason
 FROM {{ table }}
 WHERE id = $1
 -- :endmacro
 
--- :macro get_state()
--- params: guild_id, user_id
-SELECT COALESCE(
-	CASE WHEN (SELECT blacklist_reason FROM user_opt WHERE id = $2) IS NOT NULL THEN FALSE END,
-	(SELECT state FROM user_opt  WHERE id = $2),
-	(SELECT state FROM guild_opt WHERE id = $1),
-	true -- not opted in in the guild or the user table, default behavior is ENABLED
-)
--- :endmacro
-
---- BLACKLISTS
-
--- :macro get_blacklist(table_name)
--- params: id
-SELECT blacklist_reason
-FROM {{ table_name }}
-WHERE id = $1
--- :endmacro
+--- BLACKLISTS
 
 -- :macro set_blacklist(table_name)
 -- params: id, reason
@@ -256,6 +384,19 @@ INSERT INTO {{ table_name }} (id, blacklist_reason)
 VALUES ($1, $2)
 ON CONFLICT (id) DO UPDATE
 	SET blacklist_reason = EXCLUDED.blacklist_reason
+RETURNING state, blacklist_reason
+-- :endmacro
+
+-- :macro moderators()
+SELECT id
+FROM moderators
+-- :endmacro
+
+-- :macro is_moderator()
+-- params: user_id
+SELECT true
+FROM moderators
+WHERE id = $1
 -- :endmacro
 
 -- :macro blacklisted_guilds()
@@ -263,3 +404,13 @@ SELECT id
 FROM guild_opt
 WHERE blacklist_reason IS NOT NULL
 -- :endmacro
+
+--- MIGRATIONS
+
+-- :macro migration_applied()
+-- params: name
+SELECT EXISTS (
+	SELECT 1
+	FROM migrations
+	WHERE name = $1)
+-- :endmacro
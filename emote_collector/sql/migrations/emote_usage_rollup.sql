@@ -0,0 +1,50 @@
+-- Emote Collector collects emotes from other servers for use by people without Nitro
+-- Copyright © 2019 lambda#0987
+--
+-- Emote Collector is free software: you can redistribute it and/or modify
+-- it under the terms of the GNU Affero General Public License as
+-- published by the Free Software Foundation, either version 3 of the
+-- License, or (at your option) any later version.
+--
+-- Emote Collector is distributed in the hope that it will be useful,
+-- but WITHOUT ANY WARRANTY; without even the implied warranty of
+-- MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+-- GNU Affero General Public License for more details.
+--
+-- You should have received a copy of the GNU Affero General Public License
+-- along with Emote Collector. If not, see <https://www.gnu.org/licenses/>.
+
+-- adds the daily emote usage totals, and fills them in from emote_usage_history.
+-- popularity, ec/info and decay only read those totals, so the bot won't decay any emotes until this has been run.
+-- stop the bot before running this, so that no uses are written while the totals are computed.
+-- it's safe to run more than once.
+
+SET TIME ZONE UTC;
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS migrations(
+	name TEXT PRIMARY KEY,
+	applied TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP);
+
+CREATE TABLE IF NOT EXISTS emote_usage_rollup(
+	id BIGINT NOT NULL REFERENCES emotes ON DELETE CASCADE ON UPDATE CASCADE,
+	day DATE NOT NULL,
+	uses INTEGER NOT NULL,
+
+	PRIMARY KEY (id, day));
+
+-- if the totals were written to before this was run, they only hold uses that are also in the history,
+-- unless the history has since been pruned, in which case they are all that's left of those days
+INSERT INTO emote_usage_rollup (id, day, uses)
+SELECT id, (time AT TIME ZONE 'UTC')::DATE, COUNT(*)
+FROM emote_usage_history
+GROUP BY 1, 2
+ON CONFLICT (id, day) DO UPDATE
+	SET uses = GREATEST(emote_usage_rollup.uses, EXCLUDED.uses);
+
+INSERT INTO migrations (name)
+VALUES ('emote_usage_rollup')
+ON CONFLICT DO NOTHING;
+
+COMMIT;
@@ -0,0 +1,81 @@
+-- Emote Collector collects emotes from other servers for use by people without Nitro
+-- Copyright © 2019 lambda#0987
+--
+-- Emote Collector is free software: you can redistribute it and/or modify
+-- it under the terms of the GNU Affero General Public License as
+-- published by the Free Software Foundation, either version 3 of the
+-- License, or (at your option) any later version.
+--
+-- Emote Collector is distributed in the hope that it will be useful,
+-- but WITHOUT ANY WARRANTY; without even the implied warranty of
+-- MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+-- GNU Affero General Public License for more details.
+--
+-- You should have received a copy of the GNU Affero General Public License
+-- along with Emote Collector. If not, see <https://www.gnu.org/licenses/>.
+
+-- turns emote_usage_history into a table partitioned by month, which the bot can drop old uses from cheaply.
+-- every existing use is kept. the bot drops the partitions older than its raw_retention setting itself.
+-- run emote_usage_rollup.sql first, and stop the bot before running this.
+-- it's all one transaction, so if anything fails, for example because the table is already partitioned,
+-- nothing is changed.
+
+SET TIME ZONE UTC;
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS migrations(
+	name TEXT PRIMARY KEY,
+	applied TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP);
+
+DO $$ BEGIN
+	IF (SELECT relkind FROM pg_class WHERE oid = 'emote_usage_history'::REGCLASS) = 'p' THEN
+		RAISE EXCEPTION 'emote_usage_history is already partitioned';
+	END IF;
+END $$;
+
+ALTER TABLE emote_usage_history RENAME TO emote_usage_history_unpartitioned;
+-- the partitioned table's index needs this name, and nothing reads by time any more
+DROP INDEX emote_usage_history_id_idx;
+DROP INDEX IF EXISTS emote_usage_history_time_idx;
+
+CREATE TABLE emote_usage_history(
+	id BIGINT NOT NULL REFERENCES emotes ON DELETE CASCADE ON UPDATE CASCADE,
+	time TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT (CURRENT_TIMESTAMP))
+PARTITION BY RANGE (time);
+
+CREATE TABLE emote_usage_history_default PARTITION OF emote_usage_history DEFAULT;
+
+CREATE INDEX emote_usage_history_id_idx ON emote_usage_history (id);
+
+-- one partition for every month from the oldest use until next month, named the same way the bot names them
+DO $$
+DECLARE
+	month_start DATE;
+BEGIN
+	FOR month_start IN
+		SELECT generate_series(
+			date_trunc('month', MIN(time) AT TIME ZONE 'UTC'),
+			date_trunc('month', CURRENT_TIMESTAMP AT TIME ZONE 'UTC') + INTERVAL '1 month',
+			INTERVAL '1 month')::DATE
+		FROM emote_usage_history_unpartitioned
+	LOOP
+		EXECUTE format(
+			'CREATE TABLE %I PARTITION OF emote_usage_history FOR VALUES FROM (%L) TO (%L)',
+			to_char(month_start, '"emote_usage_history_"YYYY_MM'),
+			month_start || ' 00:00+00',
+			(month_start + INTERVAL '1 month')::DATE || ' 00:00+00');
+	END LOOP;
+END $$;
+
+INSERT INTO emote_usage_history (id, time)
+SELECT id, time
+FROM emote_usage_history_unpartitioned;
+
+DROP TABLE emote_usage_history_unpartitioned;
+
+INSERT INTO migrations (name)
+VALUES ('partition_emote_usage_history')
+ON CONFLICT DO NOTHING;
+
+COMMIT;
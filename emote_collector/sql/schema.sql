@@ -59,6 +59,8 @@ CREATE TABLE replies(
 	type message_reply_type NOT NULL,
 	reply_message BIGINT NOT NULL);
 
+CREATE INDEX replies_reply_message_idx ON replies (reply_message);
+
 -- https://stackoverflow.com/a/26284695/1378440
 CREATE FUNCTION update_modified_column()
 RETURNS TRIGGER AS $$
@@ -73,12 +75,26 @@ CREATE TRIGGER update_emote_modtime
 BEFORE UPDATE ON emotes
 FOR EACH ROW EXECUTE PROCEDURE update_modified_column();
 
+-- partitioned by month (UTC). the bot creates upcoming partitions and drops expired ones itself;
+-- they are named like emote_usage_history_2019_01.
 CREATE TABLE emote_usage_history(
 	id BIGINT NOT NULL REFERENCES emotes ON DELETE CASCADE ON UPDATE CASCADE,
-	time TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT (CURRENT_TIMESTAMP));
+	time TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT (CURRENT_TIMESTAMP))
+PARTITION BY RANGE (time);
+
+-- catches any uses that no monthly partition exists for yet
+CREATE TABLE emote_usage_history_default PARTITION OF emote_usage_history DEFAULT;
 
 CREATE INDEX emote_usage_history_id_idx ON emote_usage_history (id);
-CREATE INDEX emote_usage_history_time_idx ON emote_usage_history (time);
+
+-- the number of times each emote was used each day (UTC), which is what the popularity and decay queries read.
+-- kept up to date by the bot when it writes to emote_usage_history.
+CREATE TABLE emote_usage_rollup(
+	id BIGINT NOT NULL REFERENCES emotes ON DELETE CASCADE ON UPDATE CASCADE,
+	day DATE NOT NULL,
+	uses INTEGER NOT NULL,
+
+	PRIMARY KEY (id, day));
 
 --- OPTIONS / PLONKS
 
@@ -94,6 +110,9 @@ CREATE TABLE guild_opt(
 
 CREATE INDEX blacklisted_guild_idx ON guild_opt (id) WHERE blacklist_reason IS NOT NULL;
 
+CREATE TABLE moderators(
+	id BIGINT PRIMARY KEY);
+
 CREATE TABLE api_tokens(
 	id BIGINT PRIMARY KEY,
 	secret BYTEA NOT NULL);
@@ -203,3 +222,63 @@ CREATE PROCEDURE bingo_mark(
 			emote_id = NULL;
 	END IF;
 END; $$;
+
+--- CACHE INVALIDATION
+
+-- notify the cache_invalidation channel that a row changed, with a payload like "table:key".
+-- key is the values of the columns named by the trigger's arguments, separated by commas, with NULLs left empty.
+-- each bot process listens on that channel to keep its caches in sync with changes made by the others.
+CREATE FUNCTION notify_cache_invalidation()
+RETURNS TRIGGER AS $$
+DECLARE
+	new_key TEXT;
+	old_key TEXT;
+BEGIN
+	IF TG_OP != 'DELETE' THEN
+		SELECT string_agg(COALESCE(to_jsonb(NEW) ->> col, ''), ',' ORDER BY i)
+		INTO new_key
+		FROM unnest(TG_ARGV) WITH ORDINALITY AS args (col, i);
+		PERFORM pg_notify('cache_invalidation', TG_TABLE_NAME || ':' || new_key);
+	END IF;
+	IF TG_OP != 'INSERT' THEN
+		SELECT string_agg(COALESCE(to_jsonb(OLD) ->> col, ''), ',' ORDER BY i)
+		INTO old_key
+		FROM unnest(TG_ARGV) WITH ORDINALITY AS args (col, i);
+		IF old_key IS DISTINCT FROM new_key THEN
+			PERFORM pg_notify('cache_invalidation', TG_TABLE_NAME || ':' || old_key);
+		END IF;
+	END IF;
+	RETURN NULL;
+END; $$ LANGUAGE plpgsql;
+
+CREATE TRIGGER emotes_invalidate_cache
+AFTER INSERT OR UPDATE OR DELETE ON emotes
+FOR EACH ROW EXECUTE PROCEDURE notify_cache_invalidation('id');
+
+CREATE TRIGGER user_opt_invalidate_cache
+AFTER INSERT OR UPDATE OR DELETE ON user_opt
+FOR EACH ROW EXECUTE PROCEDURE notify_cache_invalidation('id');
+
+CREATE TRIGGER guild_opt_invalidate_cache
+AFTER INSERT OR UPDATE OR DELETE ON guild_opt
+FOR EACH ROW EXECUTE PROCEDURE notify_cache_invalidation('id');
+
+CREATE TRIGGER locales_invalidate_cache
+AFTER INSERT OR UPDATE OR DELETE ON locales
+FOR EACH ROW EXECUTE PROCEDURE notify_cache_invalidation('guild', 'channel', 'user');
+
+CREATE TRIGGER moderators_invalidate_cache
+AFTER INSERT OR UPDATE OR DELETE ON moderators
+FOR EACH ROW EXECUTE PROCEDURE notify_cache_invalidation('id');
+
+--- MIGRATIONS
+
+-- the one-off migrations in sql/migrations/ which have been applied to this database, or which it never needed.
+-- the bot checks for some of them before running code that depends on them.
+CREATE TABLE migrations(
+	name TEXT PRIMARY KEY,
+	applied TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP);
+
+-- a new database already has everything these would have done
+INSERT INTO migrations (name)
+VALUES ('emote_usage_rollup'), ('partition_emote_usage_history');
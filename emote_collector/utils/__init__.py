@@ -1,4 +1,6 @@
 from .misc import *  # comes first since later imports depend on it
+from . import bloom
+from . import cache
 from . import checks
 from . import context
 from . import converter
@@ -7,6 +9,10 @@ from . import custom_typing
 from . import emote
 from . import errors
 from . import i18n
+from . import invalidation
 from . import lexer
 from . import paginator
+from . import pipeline
+from . import queries
+from . import trigram
 from .proxy import ObjectProxy
@@ -0,0 +1,54 @@
+# Emote Collector collects emotes from other servers for use by people without Nitro
+# Copyright © 2018–2019 lambda#0987
+#
+# Emote Collector is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Emote Collector is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Emote Collector. If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import math
+
+class BloomFilter:
+	"""A set of IDs (64 bit unsigned integers) which may have false positives, but never false negatives.
+	Items cannot be removed.
+
+	The filter is sized so that once it holds capacity items, about error_rate of lookups for items not in it
+	will wrongly succeed. It keeps working past that, just with more false positives.
+	"""
+
+	def __init__(self, capacity, error_rate=0.01):
+		# an empty filter still has to be sized for something
+		capacity = max(1, capacity)
+		self.capacity = capacity
+		self.error_rate = error_rate
+		self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+		self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+		self._bits = bytearray((self.size + 7) // 8)
+		self.count = 0
+
+	def _indices(self, id):
+		digest = hashlib.blake2b(id.to_bytes(8, 'little'), digest_size=16).digest()
+		# Kirsch–Mitzenmacher: k indices from two hashes
+		h1 = int.from_bytes(digest[:8], 'little')
+		h2 = int.from_bytes(digest[8:], 'little') | 1
+		return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+	def add(self, id):
+		for i in self._indices(id):
+			self._bits[i >> 3] |= 1 << (i & 7)
+		self.count += 1
+
+	def __contains__(self, id):
+		return all(self._bits[i >> 3] & 1 << (i & 7) for i in self._indices(id))
+
+	def is_full(self):
+		return self.count >= self.capacity
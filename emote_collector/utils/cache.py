@@ -0,0 +1,96 @@
+# Emote Collector collects emotes from other servers for use by people without Nitro
+# Copyright © 2018–2019 lambda#0987
+#
+# Emote Collector is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Emote Collector is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Emote Collector. If not, see <https://www.gnu.org/licenses/>.
+
+"""in-memory caches for data which would otherwise be queried on every message"""
+
+import collections
+import time
+
+CacheInfo = collections.namedtuple('CacheInfo', 'hits misses size')
+
+class LRUCache:
+	"""A mapping which holds at most maxsize items, evicting the least recently used item first.
+	If ttl is not None, items also expire ttl seconds after they were set.
+
+	Looking up an item with [] or get() counts as a hit or a miss, and info() reports those counts.
+	"""
+
+	def __init__(self, maxsize=1024, *, ttl=None):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		# key → (expiry, value)
+		self._data = collections.OrderedDict()
+		self.hits = self.misses = 0
+
+	def __getitem__(self, key):
+		try:
+			expiry, value = self._data[key]
+		except KeyError:
+			self.misses += 1
+			raise
+
+		if expiry is not None and expiry < time.monotonic():
+			del self._data[key]
+			self.misses += 1
+			raise KeyError(key)
+
+		self._data.move_to_end(key)
+		self.hits += 1
+		return value
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+	def peek(self, key, default=None):
+		"""return the value for key, or default, without counting a hit or miss or marking it as recently used"""
+		try:
+			expiry, value = self._data[key]
+		except KeyError:
+			return default
+
+		if expiry is not None and expiry < time.monotonic():
+			return default
+		return value
+
+	def __setitem__(self, key, value):
+		expiry = None if self.ttl is None else time.monotonic() + self.ttl
+		self._data[key] = expiry, value
+		self._data.move_to_end(key)
+		while len(self._data) > self.maxsize:
+			self._data.popitem(last=False)
+
+	def __delitem__(self, key):
+		del self._data[key]
+
+	def discard(self, key):
+		self._data.pop(key, None)
+
+	def discard_if(self, predicate):
+		"""remove every item whose key satisfies predicate"""
+		for key in [key for key in self._data if predicate(key)]:
+			del self._data[key]
+
+	def clear(self):
+		self._data.clear()
+
+	def __len__(self):
+		return len(self._data)
+
+	def info(self):
+		return CacheInfo(self.hits, self.misses, len(self))
@@ -194,7 +194,21 @@ LINKED_EMOTE = (
 	r'\.com/emojis/(?P<id>\d{17,})\.(?P<extension>\w+)(?:\?v=1)?\)'
 )
 
-class LoggedEmote(commands.Converter):
+def logged_emotes(description):
+	"""return the name, ID, and whether it's animated, of each emote in the description of a log message's embed.
+	A log message may list several emotes, e.g. when they were decayed together.
+	"""
+	matches = list(re.finditer(LINKED_EMOTE, description)) or re.finditer(utils.lexer.t_CUSTOM_EMOTE, description)
+	return [
+		dict(
+			name=match['name'],
+			id=int(match['id']),
+			animated=match.groupdict().get('extension') == 'gif' or bool(match.groupdict().get('animated')))
+		for match in matches]
+
+class LoggedEmotes(commands.Converter):
+	"""every emote in a log message"""
+
 	async def convert(self, ctx, argument):
 		message = await commands.converter.MessageConverter().convert(ctx, argument)
 
@@ -206,15 +220,24 @@ class LoggedEmote(commands.Converter):
 		except IndexError:
 			raise commands.BadArgument(_('No embeds were found in that message.'))
 
-		m = re.match(LINKED_EMOTE, embed.description) or re.match(utils.lexer.t_CUSTOM_EMOTE, embed.description)
+		emotes = logged_emotes(embed.description or '')
+		if not emotes:
+			raise commands.BadArgument(_('No emotes were found in that message.'))
+
+		return [await self._emote(ctx, logged) for logged in emotes]
+
+	@staticmethod
+	async def _emote(ctx, logged):
 		try:
-			return await ctx.bot.cogs['Database'].get_emote(m['name'])
+			return await ctx.bot.cogs['Database'].get_emote(logged['name'])
 		except EmoteNotFoundError:
-			d = m.groupdict()
-			d['nsfw'] = 'MOD_NSFW'
-			d['id'] = int(d['id'])
-			d['animated'] = d.get('extension') == 'gif' or bool(d.get('animated'))
-			return DatabaseEmote(d)
+			return DatabaseEmote(dict(logged, nsfw='MOD_NSFW'))
+
+class LoggedEmote(commands.Converter):
+	"""the first emote in a log message"""
+
+	async def convert(self, ctx, argument):
+		return (await LoggedEmotes().convert(ctx, argument))[0]
 
 # because MultiConverter does not support Union
 class DatabaseOrLoggedEmote(commands.Converter):
@@ -58,9 +58,12 @@ class EmoteError(ConnoisseurError):
 
 class EmoteExistsError(EmoteError):
 	"""An emote with that name already exists"""
-	def __init__(self, emote):
+	def __init__(self, emote, name=None):
+		# emote is None if the existing emote was removed again before it could be looked up
 		self.emote = emote
-		super().__init__(_('An emote called “{name}” already exists in my database.'), self.emote.name)
+		super().__init__(
+			_('An emote called “{name}” already exists in my database.'),
+			name if emote is None else emote.name)
 
 class EmoteNotFoundError(EmoteError):
 	"""An emote with that name was not found"""
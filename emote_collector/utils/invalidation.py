@@ -0,0 +1,138 @@
+# Emote Collector collects emotes from other servers for use by people without Nitro
+# Copyright © 2018–2019 lambda#0987
+#
+# Emote Collector is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Emote Collector is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Emote Collector. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import collections
+import logging
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+class InvalidationBus:
+	"""Routes the notifications sent by database triggers whenever a cached table changes to the caches
+	of this process, so that changes made by other processes are seen.
+
+	Each notification has a payload like "table:key", where key holds the trigger's key columns separated by commas.
+	The handlers of that table are called with those columns as ints, or None for NULL columns.
+
+	Changes made by this process are only passed to the handlers that ask for them,
+	since most caches are updated by this process as it makes its changes.
+	To tell them apart, init_connection must be the init hook of the pool that those changes are made with.
+
+	Notifications sent while the listener is disconnected are lost, so whenever it (re)connects,
+	every handler's resync coroutine function is awaited to rebuild its cache from scratch.
+	"""
+
+	CHANNEL = 'cache_invalidation'
+	# seconds to wait before reconnecting
+	RECONNECT_DELAY = 5
+	# seconds to keep recognizing a closed connection's notifications as our own, since they arrive after its commits
+	CLOSED_PID_GRACE_PERIOD = 60
+
+	def __init__(self, bot):
+		self.bot = bot
+		# table name → [(owner, invalidate, resync, own_changes)]
+		self._handlers = collections.defaultdict(list)
+		self.listening = asyncio.Event()
+		self._task = None
+		# server PID → how many of this process's pool connections have it.
+		# those connections send the notifications of our own changes.
+		# a counter, since a closed connection's PID lingers and may be reused by a new connection meanwhile.
+		self._own_pids = collections.Counter()
+
+	def add_handler(self, owner, table, invalidate, resync, *, own_changes=False):
+		"""call invalidate(*key) whenever a row of table changes, and await resync() whenever changes may have
+		been missed. owner is only used by remove_handlers.
+		If own_changes is false, changes made by this process are not passed to invalidate.
+		"""
+		self._handlers[table].append((owner, invalidate, resync, own_changes))
+		if self.listening.is_set():
+			# we won't reconnect any time soon, and whatever this cache holds may already be stale
+			self.bot.loop.create_task(self._resync(resync))
+
+	def remove_handlers(self, owner):
+		for table, handlers in self._handlers.items():
+			handlers[:] = [handler for handler in handlers if handler[0] is not owner]
+
+	async def init_connection(self, conn):
+		"""recognize the notifications sent by conn as our own. Pass this to create_pool as init."""
+		pid = conn.get_server_pid()
+		self._own_pids[pid] += 1
+		conn.add_termination_listener(
+			lambda conn: self.bot.loop.call_later(self.CLOSED_PID_GRACE_PERIOD, self._forget_pid, pid))
+
+	def _forget_pid(self, pid):
+		self._own_pids[pid] -= 1
+		if self._own_pids[pid] <= 0:
+			del self._own_pids[pid]
+
+	def start(self):
+		self._task = self.bot.loop.create_task(self._listen())
+
+	def close(self):
+		if self._task is not None:
+			self._task.cancel()
+
+	async def _listen(self):
+		while True:
+			try:
+				conn = await asyncpg.connect(**self.bot.config['database'])
+			except (OSError, asyncpg.PostgresError) as exception:
+				logger.error('connecting the cache invalidation listener failed: %s', exception)
+				await asyncio.sleep(self.RECONNECT_DELAY)
+				continue
+
+			closed = asyncio.Event()
+			conn.add_termination_listener(lambda conn: closed.set())
+			try:
+				await conn.add_listener(self.CHANNEL, self._on_notification)
+				self.listening.set()
+				await asyncio.gather(*(
+					self._resync(resync)
+					for handlers in self._handlers.values()
+					for owner, invalidate, resync, own_changes in handlers))
+				await closed.wait()
+			except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as exception:
+				logger.error('listening for cache invalidations failed: %s', exception)
+			finally:
+				self.listening.clear()
+				conn.terminate()
+
+			logger.warning('lost the cache invalidation listener connection, reconnecting')
+			await asyncio.sleep(self.RECONNECT_DELAY)
+
+	async def _resync(self, resync):
+		try:
+			await resync()
+		except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as exception:
+			logger.error('resyncing %r failed: %s', resync, exception)
+
+	def _on_notification(self, conn, pid, channel, payload):
+		table, _, key = payload.partition(':')
+		handlers = self._handlers.get(table, ())
+		if not handlers:
+			return
+
+		key = [int(column) if column else None for column in key.split(',')]
+		is_own_change = self._own_pids[pid] > 0
+		for owner, invalidate, resync, own_changes in handlers:
+			if is_own_change and not own_changes:
+				continue
+			try:
+				invalidate(*key)
+			except Exception:
+				logger.exception('invalidating %s %s failed', table, key)
@@ -1,5 +1,3 @@
-#!/usr/bin/env python3
-
 # Emote Collector collects emotes from other servers for use by people without Nitro
 # Copyright © 2018–2019 lambda#0987
 #
@@ -16,6 +14,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Emote Collector. If not, see <https://www.gnu.org/licenses/>.
 
+import collections
+import re
+
 import ply.lex
 
 tokens = (
@@ -49,11 +50,38 @@ def t_error(t):
 # in the context of the caller's module
 new = lambda: ply.lex.lex()
 
+Token = collections.namedtuple('Token', 'type value lexpos')
+
+# The same rules as above, combined into one regex that is compiled once at import time.
+# Group names must be unique within a regex, and flags must be scoped, so the rules are restated here.
+# TEXT is left out: whatever lies between two matches is one TEXT token.
+_token_re = re.compile('|'.join(fr'(?P<{type}>{pattern})' for type, pattern in (
+	('CODE', r'(?P<code>`{1,3})(?s:.+?)(?P=code)'),
+	('ESCAPED_EMOTE', r'\\(?P<escaped_colon>[:;])(?a:\w{2,32})(?P=escaped_colon)'),
+	('CUSTOM_EMOTE', r'<a?:(?a:\w{2,32}):[0-9]{17,}>'),
+	('EMOTE', r'(?P<emote_colon>[:;])(?a:\w{2,32})(?P=emote_colon)'),
+)))
+
+def tokenize(content):
+	"""Return an iterator over the tokens in content.
+
+	Unlike the lexers returned by new(), this is safe to use from several tasks or threads at once,
+	and a run of plain text is one TEXT token rather than one token per character.
+	"""
+	pos = 0
+	for match in _token_re.finditer(content):
+		start = match.start()
+		if start != pos:
+			yield Token('TEXT', content[pos:start], pos)
+		yield Token(match.lastgroup, match[0], start)
+		pos = match.end()
+
+	if pos != len(content):
+		yield Token('TEXT', content[pos:], pos)
+
 def main():
 	import textwrap
 
-	lexer = new()
-
 	test = textwrap.dedent(r"""
 		You're mom gay
 		haha lol xd
@@ -67,14 +95,7 @@ def main():
 		`` baz ``
 		```
 	""")
-	lexer.input(test)
-
 	print(test)
 
-	for toke1 in iter(lexer.token, None):
+	for toke1 in tokenize(test):
 		print(f'{toke1.type}: {toke1.value!r}')
-
-	ply.lex.runmain()
-
-if __name__ == '__main__':
-	main()
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Emote Collector. If not, see <https://www.gnu.org/licenses/>.
 
+import abc
 import asyncio
 import collections
 import contextlib
@@ -21,6 +22,8 @@ import contextlib
 import discord
 from discord.ext.commands import CommandError
 
+from .cache import LRUCache
+
 # Derived mainly from R.Danny but also from Liara:
 # Copyright © 2015 Rapptz
 
@@ -30,6 +33,62 @@ from discord.ext.commands import CommandError
 class CannotPaginate(CommandError):
 	pass
 
+class PageSource(abc.ABC):
+	"""The entries of a paginator, fetched one page at a time instead of all up front.
+	Pass one as the entries of a Pages to paginate more entries than should be held in memory at once.
+
+	Subclasses implement fetch_page, and may override format_entry.
+	Subclasses whose entries can change while they're being paginated should override count_entries.
+	The raw entries of the last few pages shown are cached, so that moving back and forth doesn't refetch them,
+	and so that fetch_page can use them to find the neighbouring pages.
+	"""
+
+	def __init__(self, entry_count, *, cache_size=5):
+		self.entry_count = entry_count
+		# set by Pages
+		self.per_page = None
+		self._cache = LRUCache(cache_size)
+
+	def __len__(self):
+		return self.entry_count
+
+	@property
+	def page_count(self):
+		return -(-self.entry_count // self.per_page)
+
+	async def refresh(self, page):
+		"""recount the entries before page is fetched, dropping the cached pages if the count changed"""
+		if self._cache.peek(page) is not None:
+			# it'll be shown as it was fetched anyway
+			return
+		entry_count = await self.count_entries()
+		if entry_count != self.entry_count:
+			self.entry_count = entry_count
+			self._cache.clear()
+
+	def cached_page(self, page):
+		"""return the raw entries of page if they are cached, else None"""
+		return self._cache.peek(page)
+
+	async def get_page(self, page):
+		try:
+			entries = self._cache[page]
+		except KeyError:
+			entries = self._cache[page] = await self.fetch_page(page)
+		return list(map(self.format_entry, entries))
+
+	@abc.abstractmethod
+	async def fetch_page(self, page):
+		"""return the raw entries on page (1-indexed)"""
+		raise NotImplementedError
+
+	async def count_entries(self):
+		"""return how many entries there are now. By default, they never change."""
+		return self.entry_count
+
+	def format_entry(self, entry):
+		return entry
+
 class Pages:
 	"""Implements a paginator that queries the user for the
 	pagination interface.
@@ -76,6 +135,8 @@ class Pages:
 		self.channel = ctx.channel
 		self.author = ctx.author
 		self.per_page = per_page
+		if isinstance(entries, PageSource):
+			entries.per_page = per_page
 		pages, left_over = divmod(len(self.entries), self.per_page)
 		if left_over:
 			pages += 1
@@ -120,6 +181,19 @@ class Pages:
 		base = (page - 1) * self.per_page
 		return self.entries[base:base + self.per_page]
 
+	async def refresh(self, page):
+		"""return page, moved onto the last page if the entries have shrunk past it"""
+		if not isinstance(self.entries, PageSource):
+			return page
+		await self.entries.refresh(page)
+		self.maximum_pages = self.entries.page_count
+		return max(1, min(page, self.maximum_pages))
+
+	async def fetch_page(self, page):
+		if isinstance(self.entries, PageSource):
+			return await self.entries.get_page(page)
+		return self.get_page(page)
+
 	def get_content(self, entries, page, *, first=False):
 		return self.text_message
 
@@ -149,8 +223,9 @@ class Pages:
 		self.embed.description = '\n'.join(p)
 
 	async def show_page(self, page, *, first=False):
+		page = await self.refresh(page)
 		self.current_page = page
-		entries = self.get_page(page)
+		entries = await self.fetch_page(page)
 		content = self.get_content(entries, page, first=first)
 		embed = self.get_embed(entries, page, first=first)
 
@@ -323,8 +398,9 @@ class FieldPages(Pages):
 	"""
 
 	async def show_page(self, page, *, first=False):
+		page = await self.refresh(page)
 		self.current_page = page
-		entries = self.get_page(page)
+		entries = await self.fetch_page(page)
 
 		self.embed.clear_fields()
 		self.embed.description = discord.Embed.Empty
@@ -0,0 +1,55 @@
+# Emote Collector collects emotes from other servers for use by people without Nitro
+# Copyright © 2018–2019 lambda#0987
+#
+# Emote Collector is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Emote Collector is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Emote Collector. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+
+from . import i18n
+
+class MessagePipeline:
+	"""The slow parts of handling one message (its locale and invocation context), each computed at most once,
+	and only once a listener asks for them.
+
+	Every listener runs in its own task, so they're computed in shared tasks which each listener awaits.
+	Use bot.pipeline(message) to get one, once bot.should_reply(message) has said the message is worth it.
+	"""
+
+	def __init__(self, bot, message):
+		self.bot = bot
+		self.message = message
+		self._locale_task = None
+		self._context_task = None
+
+	async def locale(self):
+		if self._locale_task is None:
+			self._locale_task = self.bot.loop.create_task(self.bot.cogs['Locales'].locale(self.message))
+		# one listener being cancelled should not cancel the lookup for the others
+		return await asyncio.shield(self._locale_task)
+
+	async def set_locale(self):
+		"""set the current locale for the calling task to this message's locale"""
+		i18n.current_locale.set(await self.locale())
+
+	async def context(self):
+		"""return the invocation context for this message.
+		The context is shared between listeners, so at most one of them may consume its view.
+		"""
+		if self._context_task is None:
+			self._context_task = self.bot.loop.create_task(self._get_context())
+		return await asyncio.shield(self._context_task)
+
+	async def _get_context(self):
+		await self.set_locale()
+		return await self.bot.get_context(self.message)
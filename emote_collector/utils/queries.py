@@ -0,0 +1,55 @@
+# Emote Collector collects emotes from other servers for use by people without Nitro
+# Copyright © 2018–2019 lambda#0987
+#
+# Emote Collector is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Emote Collector is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Emote Collector. If not, see <https://www.gnu.org/licenses/>.
+
+import functools
+
+import jinja2.runtime
+
+class QueryRegistry:
+	"""The SQL macros of one template, each rendered at most once per distinct set of arguments.
+
+	Macros that take no arguments are rendered up front. The rest, including those that use varargs,
+	only ever get a handful of different arguments (sort orders, table names, flags),
+	so each variant is rendered the first time it's used, and the most recently used ones are kept.
+	Since the same variant always renders to the same string, asyncpg's per connection statement cache
+	means each one is also only prepared once per connection.
+	"""
+
+	# per macro
+	MAX_VARIANTS = 64
+
+	def __init__(self, module):
+		self._module = module
+		self._queries = {}
+		for name, value in vars(module).items():
+			if not isinstance(value, jinja2.runtime.Macro):
+				continue
+
+			if value.arguments or value.catch_varargs or value.catch_kwargs:
+				self._queries[name] = functools.lru_cache(maxsize=self.MAX_VARIANTS)(value)
+			else:
+				self._queries[name] = functools.partial(str, value())
+
+	def __getattr__(self, name):
+		try:
+			return self._queries[name]
+		except KeyError:
+			# not a macro, e.g. a variable set in the template
+			return getattr(self._module, name)
+
+	def __iter__(self):
+		"""return an iterator over the names of the macros in this registry"""
+		return iter(self._queries)
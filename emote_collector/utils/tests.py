@@ -0,0 +1,183 @@
+import asyncio
+import textwrap
+
+import jinja2
+
+from . import trigram
+from .bloom import BloomFilter
+from .cache import LRUCache
+from .converter import logged_emotes
+from .paginator import PageSource
+from .queries import QueryRegistry
+
+def test_logged_emotes_batched():
+	description = '\n'.join((
+		'[foo](https://cdn.discordapp.com/emojis/123456789012345678.png?v=1) by <@140516693242937345>',
+		'[bar_baz](https://cdn.discordapp.com/emojis/223456789012345678.gif) by <@140516693242937345>',
+		'[qux](https://cdn.discordapp.com/emojis/323456789012345678.png) by <@140516693242937345>'))
+
+	assert logged_emotes(description) == [
+		dict(name='foo', id=123456789012345678, animated=False),
+		dict(name='bar_baz', id=223456789012345678, animated=True),
+		dict(name='qux', id=323456789012345678, animated=False)]
+
+def test_logged_emotes_single():
+	description = '[foo](https://cdn.discordapp.com/emojis/123456789012345678.gif) by <@140516693242937345>'
+	assert logged_emotes(description) == [dict(name='foo', id=123456789012345678, animated=True)]
+
+def test_logged_emotes_inline():
+	description = '<a:foo:123456789012345678> <:bar:223456789012345678> by <@140516693242937345>'
+	assert logged_emotes(description) == [
+		dict(name='foo', id=123456789012345678, animated=True),
+		dict(name='bar', id=223456789012345678, animated=False)]
+
+def test_logged_emotes_none():
+	assert logged_emotes('') == []
+	assert logged_emotes('no emotes here') == []
+
+def test_trigrams():
+	# the results of show_trgm
+	assert trigram.trigrams('word') == {'  w', ' wo', 'wor', 'ord', 'rd '}
+	assert trigram.trigrams('Foo_Bar') == {'  f', ' fo', 'foo', 'oo ', '  b', ' ba', 'bar', 'ar '}
+	assert trigram.trigrams('a') == {'  a', ' a '}
+	assert trigram.trigrams('') == trigram.trigrams('__') == set()
+
+def test_similarity():
+	# the results of similarity, which postgres rounds to 6 places
+	assert round(trigram.similarity('word', 'two words'), 6) == 0.363636
+	assert round(trigram.similarity('hello', 'hallo'), 6) == 0.333333
+	assert trigram.similarity('Kappa', 'kappa') == 1.0
+	assert trigram.similarity('abc', 'xyz') == 0.0
+	assert trigram.similarity('abc', '') == 0.0
+
+def test_trigram_index():
+	index = trigram.TrigramIndex()
+	for key, s in enumerate(('kappa', 'Kappa_Pride', 'keepo', 'kapp', 'lul')):
+		index.add(key, s)
+
+	# kappa: 1.0, kapp: 0.571429, Kappa_Pride: 0.5. keepo shares too little.
+	assert index.search('kappa') == [0, 3, 1]
+	assert index.search('kappa', threshold=0.55) == [0, 3]
+	assert index.search('zzz') == []
+
+	index.add(0, 'lul_two')
+	assert index.search('kappa') == [3, 1]
+	index.discard(3)
+	index.discard(3)
+	assert index.search('kappa') == [1]
+	assert len(index) == 4
+
+def test_similarity_ties_sort_case_insensitively():
+	index = trigram.TrigramIndex()
+	index.add(1, 'b_ab')
+	index.add(2, 'A_ab')
+	index.add(3, 'ab')
+	assert index.search('ab', threshold=0) == [3, 2, 1]
+
+def test_bloom_filter():
+	bloom = BloomFilter(1_000)
+	ids = range(10**17, 10**17 + 1_000)
+	for id in ids:
+		bloom.add(id)
+
+	# no false negatives
+	assert all(id in bloom for id in ids)
+	assert bloom.is_full()
+
+	false_positives = sum(id in bloom for id in range(2 * 10**17, 2 * 10**17 + 10_000))
+	# about 1% are expected
+	assert false_positives < 300
+
+def test_bloom_filter_tiny():
+	bloom = BloomFilter(1)
+	assert not bloom.is_full()
+	bloom.add(2**64 - 1)
+	assert 2**64 - 1 in bloom
+	assert bloom.is_full()
+
+def test_bloom_filter_empty():
+	bloom = BloomFilter(0)
+	assert not bloom.is_full()
+	assert 1 not in bloom
+
+def test_lru_cache():
+	cache = LRUCache(2)
+	cache['a'] = 1
+	cache['b'] = 2
+	assert cache['a'] == 1
+	cache['c'] = 3
+	# b was the least recently used
+	assert 'b' not in cache._data
+	assert cache.get('b') is None
+	assert cache.info() == (1, 1, 2)
+
+	# peeking doesn't count, or protect a from eviction
+	assert cache.peek('a') == 1
+	cache['d'] = 4
+	assert cache.peek('a') is None
+	assert cache.info() == (1, 1, 2)
+
+	cache.discard_if(lambda key: key == 'c')
+	assert list(cache._data) == ['d']
+
+def test_lru_cache_ttl():
+	cache = LRUCache(ttl=-1)
+	cache['a'] = 1
+	assert cache.peek('a') is None
+	assert cache.get('a') is None
+	assert len(cache) == 0
+
+def test_query_registry():
+	env = jinja2.Environment(line_statement_prefix='-- :')
+	queries = QueryRegistry(env.from_string(textwrap.dedent('''
+		-- :macro plain()
+		SELECT 1
+		-- :endmacro
+
+		-- :macro with_argument(table)
+		SELECT * FROM {{ table }}
+		-- :endmacro
+
+		-- :macro with_varargs()
+		SELECT 1
+		-- :if 'extra' in varargs
+		, 2
+		-- :endif
+		-- :endmacro
+	''')).module)
+
+	assert queries.plain().split() == ['SELECT', '1']
+	assert queries.with_argument('emotes').split() == ['SELECT', '*', 'FROM', 'emotes']
+	assert queries.with_varargs().split() == ['SELECT', '1']
+	assert queries.with_varargs('extra').split() == ['SELECT', '1', ',', '2']
+	assert set(queries) == {'plain', 'with_argument', 'with_varargs'}
+
+def test_page_source_refresh():
+	class Source(PageSource):
+		def __init__(self, entries):
+			super().__init__(len(entries))
+			self.entries = entries
+
+		async def fetch_page(self, page):
+			start = (page - 1) * self.per_page
+			return self.entries[start:start+self.per_page]
+
+		async def count_entries(self):
+			return len(self.entries)
+
+	async def run():
+		source = Source(list(range(10)))
+		source.per_page = 3
+		assert await source.get_page(4) == [9]
+		assert source.page_count == 4
+
+		del source.entries[8:]
+		# cached pages aren't recounted
+		await source.refresh(4)
+		assert source.page_count == 4
+
+		await source.refresh(1)
+		assert source.page_count == 3
+		assert source.cached_page(4) is None
+
+	asyncio.run(run())
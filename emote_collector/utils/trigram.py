@@ -0,0 +1,103 @@
+# Emote Collector collects emotes from other servers for use by people without Nitro
+# Copyright © 2018–2019 lambda#0987
+#
+# Emote Collector is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# Emote Collector is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Emote Collector. If not, see <https://www.gnu.org/licenses/>.
+
+"""fuzzy string matching compatible with postgres' pg_trgm extension"""
+
+import collections
+import re
+
+# pg_trgm's default pg_trgm.similarity_threshold, used by the % operator
+SIMILARITY_THRESHOLD = 0.3
+
+# pg_trgm only considers alphanumeric characters part of words, so this also splits on underscores
+_non_word_chars = re.compile(r'[\W_]+')
+
+def trigrams(s) -> frozenset:
+	"""return the set of trigrams of s, like pg_trgm's show_trgm(s)"""
+	result = set()
+	for word in _non_word_chars.split(s.lower()):
+		if not word:
+			continue
+		padded = f'  {word} '
+		result.update(padded[i:i+3] for i in range(len(padded) - 2))
+	return frozenset(result)
+
+def similarity(a, b):
+	"""return how similar a and b are, from 0 to 1, like pg_trgm's similarity(a, b)"""
+	a, b = trigrams(a), trigrams(b)
+	if not a or not b:
+		return 0.0
+	shared = len(a & b)
+	return shared / (len(a) + len(b) - shared)
+
+class TrigramIndex:
+	"""An index of strings by key, which finds the strings similar to a query the same way as pg_trgm.
+
+	Each trigram maps to the keys of the strings containing it,
+	so a search only looks at strings that share at least one trigram with the query.
+	"""
+
+	def __init__(self):
+		# trigram → keys
+		self._postings = collections.defaultdict(set)
+		# key → (string, trigrams)
+		self._strings = {}
+
+	def __len__(self):
+		return len(self._strings)
+
+	def add(self, key, s):
+		"""index s under key, replacing whatever key was indexed under before"""
+		self.discard(key)
+		s_trigrams = trigrams(s)
+		self._strings[key] = s, s_trigrams
+		for trigram in s_trigrams:
+			self._postings[trigram].add(key)
+
+	def discard(self, key):
+		try:
+			s, s_trigrams = self._strings.pop(key)
+		except KeyError:
+			return
+
+		for trigram in s_trigrams:
+			keys = self._postings[trigram]
+			keys.discard(key)
+			if not keys:
+				del self._postings[trigram]
+
+	def clear(self):
+		self._postings.clear()
+		self._strings.clear()
+
+	def search(self, query, *, threshold=SIMILARITY_THRESHOLD):
+		"""return the keys of the strings at least threshold similar to query.
+		They're sorted like ORDER BY similarity(s, query) DESC, LOWER(s).
+		"""
+		query_trigrams = trigrams(query)
+		shared = collections.Counter()
+		for trigram in query_trigrams:
+			shared.update(self._postings.get(trigram, ()))
+
+		results = []
+		for key, shared_count in shared.items():
+			s, s_trigrams = self._strings[key]
+			score = shared_count / (len(query_trigrams) + len(s_trigrams) - shared_count)
+			if score >= threshold:
+				results.append((-score, s.lower(), key))
+
+		results.sort(key=lambda result: result[:2])
+		return [key for score, s, key in results]
@@ -10,6 +10,7 @@ setuptools.setup(
 	packages=[
 		'emote_collector',
 		'emote_collector.utils',
+		'emote_collector.utils.lexer',
 		'emote_collector.extensions',
 	],
 